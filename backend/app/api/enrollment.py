@@ -7,10 +7,12 @@ from fastapi import (
     Form, Body
 )
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Any
 from app.schemas.enrollment import EnrollmentSearchFilter
 from app.schemas.profile import ProfileCreate
-from app.core.db import get_session
+from app.core.db import get_session, get_async_session
+from app.core.ingest_jobs import ingest_queue
 import app.crud.enrollment as crud_enrollments
 
 router = APIRouter(
@@ -20,36 +22,46 @@ router = APIRouter(
 
 @router.post(
     "/upload",
-    summary="Upload a student list to enroll in a course"
+    status_code=202,
+    summary="Upload a student list to enroll in a course, processed in the background"
 )
 async def upload_enrollment_file(
         *,
-        db: Session = Depends(get_session),
         course_id: int = Form(..., description="The ID of the course to enroll into"),
         file: UploadFile = File(..., description="Student list file (CSV, Excel, or Image)")
 ) -> Any:
     try:
-        result = await crud_enrollments.enroll_students_from_file(
-            db=db,
+        job, created = await crud_enrollments.start_enrollment_ingest(
             course_id=course_id,
             file=file
         )
-        return result
-
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"An unexpected error occurred: {str(e)}"
         )
 
+    message = "Đã nhận file, đang xử lý nền." if created else "File này đã được gửi trước đó."
+    return {"success": True, "message": message, "duplicate": not created, **job.to_dict()}
+
+@router.get("/jobs/{job_id}", summary="Progress of a background enrollment upload")
+def get_enrollment_job(job_id: str) -> Any:
+
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    return job.to_dict()
+
 @router.post("/search")
 async def search_enrollments(
     *,
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_async_session),
     filter_params: EnrollmentSearchFilter = Body(...)
 ) -> Any:
 
-    result = crud_enrollments.search_enrollments(
+    result = await crud_enrollments.search_enrollments(
         db=db,
         filter=filter_params
     )
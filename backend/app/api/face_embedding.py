@@ -1,56 +1,81 @@
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 
-from fastapi import APIRouter, HTTPException, Depends
-from sqlmodel import Session, text
+import asyncio
+import json
+
+from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from sqlmodel import select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
 import httpx
-from app.core.db import get_session
+import numpy as np
+import websockets
+from app.core.db import async_session, get_async_session, to_db_vector, from_db_vector, vector_literal
+from app.core.embedding_codec import (
+    ACCEPT_HEADER,
+    AI_EMBEDDING_ENCODING,
+    PREFERRED_MEDIA_TYPE,
+    decode_embedding,
+    response_media_type,
+)
+from app.core.streaming import LatestFrameSlot
+from app.core.face_client import face_client, CircuitOpen
+from app.core.schedule_cache import schedule_cache, ActiveSchedule
+from app.core.face_index import face_index, MATCH_SCOPE, MAX_EMBEDDINGS_PER_PROFILE
+from app.crud.attendance_summary import CHECK_IN_SUMMARY_CTE
 from app.models.profile import Profile
 from app.schemas.profile import ProfilePublic
 from app.schemas.public import (
     EnrollRequest,
+    BulkEnrollRequest,
+    BulkEnrollResponse,
+    BulkEnrollResult,
     SearchRequest,
     EnrollResponse,
     SearchResponse,
+    MultiSearchRequest,
+    MultiSearchResponse,
+    FaceCheckInResult,
 )
 
 import os
 
 AI_SERVICE_BASE_URL = os.getenv("AI_SERVICE_BASE_URL", "http://localhost:8080")
 AI_EMBEDDING_ENDPOINT = f"{AI_SERVICE_BASE_URL}/api/embedding"
-AI_EMBEDDING_ENDPOINT = f"{AI_SERVICE_BASE_URL}/api/embedding"
+AI_BATCH_ENDPOINT = f"{AI_SERVICE_BASE_URL}/api/embedding/batch"
+AI_FACES_ENDPOINT = f"{AI_SERVICE_BASE_URL}/api/embedding/faces"
 AI_HEALTH_ENDPOINT = f"{AI_SERVICE_BASE_URL}/health"
+AI_STREAM_ENDPOINT = f"{AI_SERVICE_BASE_URL.replace('http', 'ws', 1)}/ws/embedding?encoding={AI_EMBEDDING_ENCODING}"
+
+MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", "1.0"))
 
 router = APIRouter(
     prefix="/face_embedding",
     tags=["Face_Embedding"]
 )
 
-async def get_embedding_from_api(image_base64: str) -> list:
-
+async def _call_ai_service(endpoint: str, payload: dict) -> tuple:
+    """
+    (JSON body, media type); embeddings in the body are encoded per the media type.
+    """
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                AI_EMBEDDING_ENDPOINT,
-                json={"image_base64": image_base64}
+        response = await face_client.post(endpoint, json=payload, headers={"Accept": ACCEPT_HEADER})
+
+        if response.status_code != 200:
+            retry_after = response.headers.get("Retry-After")
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Embedding API error: {response.text}",
+                headers={"Retry-After": retry_after} if retry_after else None
             )
 
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Embedding API error: {response.text}"
-                )
-
-            result = response.json()
-            embedding = result.get("embedding")
-
-            if not embedding:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Dont detect face in the image or embedding missing in response"
-                )
-
-            return embedding
+        return response.json(), response_media_type(response.headers.get("content-type"))
 
+    except CircuitOpen as e:
+        raise HTTPException(
+            status_code=503,
+            detail="AI Service đang không phản hồi, tạm ngừng gửi yêu cầu",
+            headers={"Retry-After": str(int(e.retry_after))}
+        )
     except httpx.TimeoutException:
         raise HTTPException(
             status_code=504,
@@ -69,153 +94,477 @@ async def get_embedding_from_api(image_base64: str) -> list:
             detail=f"Unexpected error calling embedding API: {str(e)}"
         )
 
+async def get_embedding_from_api(image_base64: str) -> np.ndarray:
+
+    result, media_type = await _call_ai_service(AI_EMBEDDING_ENDPOINT, {"image_base64": image_base64})
+    embedding = decode_embedding(result.get("embedding"), media_type)
+
+    if embedding is None:
+        raise HTTPException(
+            status_code=500,
+            detail="Dont detect face in the image or embedding missing in response"
+        )
+
+    return embedding
+
+async def get_embeddings_batch_from_api(images_base64: list) -> list:
+    """
+    One embedding (or None when no face was found) per image, in one call.
+    """
+    result, media_type = await _call_ai_service(AI_BATCH_ENDPOINT, {"images_base64": images_base64})
+    embeddings = [None] * len(images_base64)
+    for item in result.get("results") or []:
+        if item.get("success"):
+            embeddings[item["index"]] = decode_embedding(item.get("embedding"), media_type)
+    return embeddings
+
+async def get_face_embeddings_from_api(image_base64: str) -> list:
+    """
+    Every face in the frame as {"box", "probability", "embedding"}.
+    """
+    result, media_type = await _call_ai_service(AI_FACES_ENDPOINT, {"image_base64": image_base64})
+    faces = result.get("faces") or []
+    for face in faces:
+        face["embedding"] = decode_embedding(face["embedding"], media_type)
+    return faces
+
+def attendance_status(schedule: ActiveSchedule, now: datetime) -> str:
+
+    late_threshold = schedule.start_time + schedule.late_threshold
+    return "present" if now <= late_threshold else "late"
+
+async def get_or_create_profile(session: AsyncSession, student_id: str, name: str) -> Profile:
+
+    profile = (await session.exec(select(Profile).where(Profile.student_id == student_id))).first()
+
+    if not profile:
+        profile = Profile(
+            student_id=student_id,
+            name=name,
+            role='student'
+        )
+        session.add(profile)
+        await session.flush()
+
+    return profile
+
+async def save_face_templates(session: AsyncSession, profile_id: int, vectors: list, replace: bool = False) -> list:
+    """
+    Thêm embedding mới cho sinh viên, chỉ giữ MAX_EMBEDDINGS_PER_PROFILE embedding
+    mới nhất. Trả về toàn bộ embedding hiện có của sinh viên để cập nhật face_index.
+    """
+    if replace:
+        await session.execute(
+            text("DELETE FROM face_embeddings WHERE profile_id = :pid"),
+            {"pid": profile_id}
+        )
+
+    if vectors:
+        insert_sql = text("""
+                          INSERT INTO face_embeddings (profile_id, embedding)
+                          VALUES (:pid, :vec)
+                          """)
+        await session.execute(insert_sql, [{"pid": profile_id, "vec": to_db_vector(vector)} for vector in vectors])
+
+    trim_sql = text("""
+                    DELETE FROM face_embeddings
+                    WHERE profile_id = :pid
+                      AND id NOT IN (
+                          SELECT id FROM face_embeddings
+                          WHERE profile_id = :pid
+                          ORDER BY id DESC
+                          LIMIT :max
+                      )
+                    """)
+    await session.execute(trim_sql, {"pid": profile_id, "max": MAX_EMBEDDINGS_PER_PROFILE})
+
+    rows = (await session.execute(
+        text("SELECT embedding FROM face_embeddings WHERE profile_id = :pid ORDER BY id"),
+        {"pid": profile_id}
+    )).fetchall()
+    return [from_db_vector(row.embedding) for row in rows]
+
 @router.post("/enroll", response_model=EnrollResponse)
 async def enroll_face(
         request: EnrollRequest,
-        session: Session = Depends(get_session)
+        session: AsyncSession = Depends(get_async_session)
 ):
     vector = await get_embedding_from_api(request.image_base64)
-    vector_str = str(list(vector))
 
     try:
 
-        profile = session.query(Profile).filter(Profile.student_id == request.studentId).first()
+        profile = await get_or_create_profile(session, request.studentId, request.name)
+        templates = await save_face_templates(session, profile.id, [vector], request.replace)
 
-        if not profile:
-            profile = Profile(
-                student_id=request.studentId,
-                name=request.name,
-                role='student'
-            )
-            session.add(profile)
-            session.flush()
-
-        check_exist = session.execute(
-            text("SELECT id FROM face_embeddings WHERE profile_id = :pid"),
-            {"pid": profile.id}
-        ).fetchone()
-
-        if check_exist:
-            update_sql = text("""
-                              UPDATE face_embeddings
-                              SET embedding = :vec
-                              WHERE profile_id = :pid
-                              """)
-            session.execute(update_sql, {"pid": profile.id, "vec": vector_str})
-        else:
-            insert_sql = text("""
-                              INSERT INTO face_embeddings (profile_id, embedding)
-                              VALUES (:pid, :vec)
-                              """)
-            session.execute(insert_sql, {"pid": profile.id, "vec": vector_str})
+        await session.commit()
 
-        session.commit()
-        session.refresh(profile)
+        face_index.upsert(profile.id, profile.name, profile.student_id, templates)
 
         profile_public = ProfilePublic.from_orm(profile)
         return EnrollResponse(data=profile_public)
 
     except Exception as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=500, detail=f"Lỗi Database: {str(e)}")
 
+@router.post("/enroll/bulk", response_model=BulkEnrollResponse)
+async def enroll_faces_bulk(
+        request: BulkEnrollRequest,
+        session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Đăng ký nhiều ảnh (nhiều góc mặt, ánh sáng) cho nhiều sinh viên; toàn bộ ảnh
+    được gửi sang face_service trong một lần gọi batch.
+    """
+    images = [image for student in request.students for image in student.images_base64]
+    embeddings = await get_embeddings_batch_from_api(images) if images else []
+
+    results = []
+    updated = []
+    offset = 0
+    try:
+        for student in request.students:
+            student_embeddings = embeddings[offset:offset + len(student.images_base64)]
+            offset += len(student.images_base64)
+
+            vectors = [vector for vector in student_embeddings if vector is not None]
+            failed = [i for i, vector in enumerate(student_embeddings) if vector is None]
+            if not vectors:
+                results.append(BulkEnrollResult(studentId=student.studentId, failed_images=failed))
+                continue
+
+            profile = await get_or_create_profile(session, student.studentId, student.name)
+            templates = await save_face_templates(session, profile.id, vectors, request.replace)
+            updated.append((profile.id, profile.name, profile.student_id, templates))
+            results.append(BulkEnrollResult(
+                studentId=student.studentId,
+                profile_id=profile.id,
+                templates=len(templates),
+                failed_images=failed
+            ))
+
+        await session.commit()
+
+    except Exception as e:
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"Lỗi Database: {str(e)}")
+
+    for profile_id, name, student_id, templates in updated:
+        face_index.upsert(profile_id, name, student_id, templates)
+
+    return BulkEnrollResponse(enrolled=len(updated), results=results)
+
 @router.post("/search-face", response_model=SearchResponse)
 async def search_face(
     request: SearchRequest,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
 
     vector = await get_embedding_from_api(request.image_base64)
-    vector_str = str(list(vector))
+    return await check_in_by_embedding(session, request.course_id, vector)
 
-    match_sql = text("SELECT * FROM match_users(:vec, :threshold, :count)")
-    result = session.execute(
+async def match_embedding(session: AsyncSession, vector: np.ndarray, course_id: int):
+    """
+    Sinh viên khớp nhất với embedding: tra trong face_index (toàn trường hoặc chỉ
+    sinh viên của môn học, theo MATCH_SCOPE), hàm match_users của Postgres chỉ
+    dùng khi index chưa sẵn sàng.
+    """
+    if face_index.ready:
+        return (await match_embeddings(session, [vector], course_id))[0]
+
+    match_sql = text("SELECT * FROM match_users(:vec, :threshold, 1)")
+    result = await session.execute(
         match_sql,
-        {"vec": vector_str, "threshold": 1, "count": 1}
+        {"vec": to_db_vector(vector), "threshold": MATCH_THRESHOLD}
     )
-    found_user = result.fetchone()
+    return result.fetchone()
 
-    if not found_user:
-        raise HTTPException(404, "Không tìm thấy sinh viên khớp khuôn mặt")
+async def match_embeddings(session: AsyncSession, vectors: list, course_id: int) -> list:
 
-    profile_id = found_user.profile_id
+    if face_index.ready:
+        if MATCH_SCOPE == "course":
+            return await face_index.asearch_in_course(session, course_id, vectors, MATCH_THRESHOLD)
+        return face_index.search_many(vectors, MATCH_THRESHOLD)
 
-    enroll_sql = text("""
-        SELECT 1
-        FROM enrollments
-        WHERE course_id = :cid AND profile_id = :pid
+    match_sql = text("""
+        SELECT q.ord, m.profile_id, m.name, m.student_id
+        FROM unnest(CAST(:vecs AS text[])) WITH ORDINALITY AS q(vec, ord)
+        CROSS JOIN LATERAL match_users(CAST(q.vec AS vector), :threshold, 1) AS m
     """)
-    enrolled = session.execute(enroll_sql, {
-        "cid": request.course_id,
-        "pid": profile_id
-    }).fetchone()
+    rows = (await session.execute(match_sql, {
+        "vecs": [vector_literal(vector) for vector in vectors],
+        "threshold": MATCH_THRESHOLD
+    })).fetchall()
+
+    matches = [None] * len(vectors)
+    for row in rows:
+        matches[row.ord - 1] = row
+    return matches
+
+async def check_in_by_embedding(session: AsyncSession, course_id: int, vector: np.ndarray) -> SearchResponse:
+    """
+    Nhận diện sinh viên từ embedding và ghi điểm danh cho buổi học đang diễn ra.
+    Buổi học đang diễn ra lấy từ schedule_cache; kiểm tra đăng ký và ghi log
+    trong một câu lệnh SQL.
+    """
+    now = datetime.now(timezone.utc)
+    schedule = await schedule_cache.alookup(session, course_id, now)
+    params = {
+        "cid": course_id,
+        "sid": schedule.id if schedule else None,
+        "status": attendance_status(schedule, now) if schedule else None,
+    }
+
+    if face_index.ready:
+        found_user = await match_embedding(session, vector, course_id)
+        if not found_user:
+            raise HTTPException(404, "Không tìm thấy sinh viên khớp khuôn mặt")
+        match_cte = "SELECT CAST(:pid AS bigint) AS profile_id, CAST(:name AS text) AS name, CAST(:student_id AS text) AS student_id"
+        params.update(pid=found_user.profile_id, name=found_user.name, student_id=found_user.student_id)
+    else:
+        match_cte = "SELECT profile_id, name, student_id FROM match_users(:vec, :threshold, 1)"
+        params.update(vec=to_db_vector(vector), threshold=MATCH_THRESHOLD)
+
+    check_in_sql = text(f"""
+        WITH m AS (
+            {match_cte}
+        ),
+        enrolled AS (
+            SELECT 1
+            FROM enrollments e
+            JOIN m ON m.profile_id = e.profile_id
+            WHERE e.course_id = :cid
+            LIMIT 1
+        ),
+        sched AS (
+            SELECT CAST(:sid AS integer) AS id
+            WHERE CAST(:sid AS integer) IS NOT NULL
+        ),
+        ins AS (
+            INSERT INTO attendance_logs (schedule_id, profile_id, status)
+            SELECT s.id, m.profile_id, CAST(:status AS text)
+            FROM sched s, m
+            WHERE EXISTS (SELECT 1 FROM enrolled)
+            ON CONFLICT (schedule_id, profile_id) DO NOTHING
+            RETURNING profile_id, status
+        ),{CHECK_IN_SUMMARY_CTE}
+        SELECT m.profile_id, m.name, m.student_id,
+               EXISTS (SELECT 1 FROM enrolled) AS enrolled,
+               (SELECT status FROM ins) AS status
+        FROM m
+    """)
+
+    try:
+        row = (await session.execute(check_in_sql, params)).fetchone()
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        raise HTTPException(500, f"Lỗi ghi điểm danh: {str(e)}")
+
+    if not row:
+        raise HTTPException(404, "Không tìm thấy sinh viên khớp khuôn mặt")
 
-    if not enrolled:
+    if not row.enrolled:
         raise HTTPException(
             403,
-            f"Sinh viên {found_user.name} ({found_user.student_id}) chưa đăng ký môn học này."
+            f"Sinh viên {row.name} ({row.student_id}) chưa đăng ký môn học này."
         )
 
-    now  = datetime.now(timezone.utc)
+    if schedule is None:
+        raise HTTPException(
+            400,
+            "Hiện tại không có buổi học nào đang diễn ra."
+        )
 
-    schedule_sql = text("""
-        SELECT *
-        FROM schedules
-        WHERE course_id = :cid
-          AND start_time <= :now
-          AND end_time >= :now
-        LIMIT 1
-    """)
-    schedule = session.execute(schedule_sql, {
-        "cid": request.course_id,
-        "now": now
-    }).fetchone()
+    if row.status is None:
+        raise HTTPException(409, "Sinh viên đã điểm danh buổi này rồi")
+
+    return SearchResponse(
+        name=row.name,
+        student_id=row.student_id,
+        status=row.status,
+        schedule_id=schedule.id
+    )
+
+@router.post("/search-faces", response_model=MultiSearchResponse)
+async def search_faces(
+    request: MultiSearchRequest,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Điểm danh tất cả sinh viên nhận diện được trong một khung hình (camera lớp học).
+    """
+    now = datetime.now(timezone.utc)
 
+    schedule = await schedule_cache.alookup(session, request.course_id, now)
     if not schedule:
         raise HTTPException(
             400,
             "Hiện tại không có buổi học nào đang diễn ra."
         )
 
-    late_threshold = schedule.start_time + timedelta(minutes=10)
+    faces = await get_face_embeddings_from_api(request.image_base64)
+    results = [
+        FaceCheckInResult(box=face["box"], probability=face["probability"], status="unknown")
+        for face in faces
+    ]
+    if not faces:
+        return MultiSearchResponse(
+            schedule_id=schedule.id, total_faces=0, checked_in=0, results=results
+        )
 
-    status = "present" if now <= late_threshold else "late"
+    matches = await match_embeddings(session, [face["embedding"] for face in faces], request.course_id)
 
-    check_log = text("""
-        SELECT 1
-        FROM attendance_logs
-        WHERE schedule_id = :sid AND profile_id = :pid
-    """)
-    exists = session.execute(check_log, {
-        "sid": schedule.id,
-        "pid": profile_id
-    }).fetchone()
+    matched = {}
+    for result, match in zip(results, matches):
+        if match is None:
+            continue
+        result.profile_id = match.profile_id
+        result.name = match.name
+        result.student_id = match.student_id
+        matched.setdefault(match.profile_id, result)
 
-    if exists:
-        raise HTTPException(409, "Sinh viên đã điểm danh buổi này rồi")
+    if not matched:
+        return MultiSearchResponse(
+            schedule_id=schedule.id, total_faces=len(faces), checked_in=0, results=results
+        )
 
-    try:
-        insert_sql = text("""
+    status = attendance_status(schedule, now)
+    # enrollment check, insert and attendance summary in one statement; ON CONFLICT
+    # covers students already checked in, including by a concurrent request
+    check_in_sql = text(f"""
+        WITH cand AS (
+            SELECT DISTINCT unnest(CAST(:pids AS bigint[])) AS profile_id
+        ),
+        enrolled AS (
+            SELECT DISTINCT e.profile_id
+            FROM enrollments e
+            JOIN cand c ON c.profile_id = e.profile_id
+            WHERE e.course_id = :cid
+        ),
+        ins AS (
             INSERT INTO attendance_logs (schedule_id, profile_id, status)
-            VALUES (:sid, :pid, :status)
-        """)
-        session.execute(insert_sql, {
+            SELECT CAST(:sid AS integer), profile_id, CAST(:status AS text)
+            FROM enrolled
+            ON CONFLICT (schedule_id, profile_id) DO NOTHING
+            RETURNING profile_id, status
+        ),{CHECK_IN_SUMMARY_CTE}
+        SELECT c.profile_id,
+               en.profile_id IS NOT NULL AS enrolled,
+               i.profile_id IS NOT NULL AS inserted
+        FROM cand c
+        LEFT JOIN enrolled en ON en.profile_id = c.profile_id
+        LEFT JOIN ins i ON i.profile_id = c.profile_id
+    """)
+
+    try:
+        rows = (await session.execute(check_in_sql, {
+            "pids": list(matched),
+            "cid": request.course_id,
             "sid": schedule.id,
-            "pid": profile_id,
             "status": status
-        })
-        session.commit()
-
+        })).fetchall()
+        await session.commit()
     except Exception as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, f"Lỗi ghi điểm danh: {str(e)}")
 
-    return SearchResponse(
-        name=found_user.name,
-        student_id=found_user.student_id,
-        status=status,
-        schedule_id=schedule.id
+    outcome = {row.profile_id: row for row in rows}
+    checked_in = 0
+    for result in results:
+        if result.profile_id is None:
+            continue
+        row = outcome[result.profile_id]
+        if not row.enrolled:
+            result.status = "not_enrolled"
+        elif not row.inserted:
+            result.status = "already_checked_in"
+        elif matched[result.profile_id] is not result:
+            # same student matched twice in one frame
+            result.status = "duplicate"
+        else:
+            result.status = status
+            checked_in += 1
+
+    return MultiSearchResponse(
+        schedule_id=schedule.id,
+        total_faces=len(faces),
+        checked_in=checked_in,
+        results=results
     )
+
+async def _receive_frames(websocket: WebSocket, slot: LatestFrameSlot):
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            frame = message.get("bytes") or message.get("text")
+            if frame:
+                slot.put(frame)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        slot.close()
+
+@router.websocket("/ws/search-face")
+async def search_face_stream(
+    websocket: WebSocket,
+    course_id: int
+):
+    """
+    Điểm danh liên tục qua WebSocket: client gửi khung hình (binary hoặc base64),
+    server chỉ xử lý khung hình mới nhất và trả kết quả nhận diện cho từng khung.
+    Mỗi khung hình mượn một kết nối DB riêng, không giữ kết nối suốt phiên.
+    """
+    await websocket.accept()
+    slot = LatestFrameSlot()
+    receiver = asyncio.create_task(_receive_frames(websocket, slot))
+
+    try:
+        async with websockets.connect(AI_STREAM_ENDPOINT, max_size=None) as upstream:
+            while True:
+                frame = await slot.get()
+                if frame is None:
+                    break
+
+                await upstream.send(frame)
+                reply = json.loads(await upstream.recv())
+
+                if not reply.get("success"):
+                    result = {
+                        "success": False,
+                        "status_code": 422,
+                        "detail": reply.get("message") or "Dont detect face in the image"
+                    }
+                else:
+                    try:
+                        vector = decode_embedding(reply["embedding"], PREFERRED_MEDIA_TYPE)
+                        async with async_session() as session:
+                            response = await check_in_by_embedding(session, course_id, vector)
+                        result = response.dict()
+                    except HTTPException as e:
+                        result = {"success": False, "status_code": e.status_code, "detail": e.detail}
+
+                result["dropped"] = slot.dropped
+                await websocket.send_json(result)
+
+    except WebSocketDisconnect:
+        pass
+    except (OSError, websockets.exceptions.WebSocketException) as e:
+        await websocket.close(code=1011, reason=f"Embedding stream unavailable: {str(e)}"[:120])
+    finally:
+        receiver.cancel()
+
+@router.get("/index/recall")
+def index_recall(sample_size: int = 200, noise: float = 0.05):
+    """
+    So sánh recall@1 của engine tìm kiếm gần đúng (ivf/hnsw) với tìm kiếm chính xác
+    """
+    if not face_index.ready:
+        raise HTTPException(503, "Face index chưa sẵn sàng")
+    return face_index.recall_report(sample_size, noise)
+
 @router.get("/health")
 async def health_check():
     """
@@ -223,17 +572,20 @@ async def health_check():
     """
     embedding_status = "unknown"
     try:
-        async with httpx.AsyncClient(timeout=3.0) as client:
-            response = await client.get(AI_HEALTH_ENDPOINT)
-            if response.status_code == 200:
-                embedding_status = "healthy"
-            else:
-                embedding_status = f"unhealthy_status_{response.status_code}"
+        response = await face_client.get(AI_HEALTH_ENDPOINT, timeout=3.0)
+        if response.status_code == 200:
+            embedding_status = "healthy"
+        else:
+            embedding_status = f"unhealthy_status_{response.status_code}"
+    except CircuitOpen:
+        embedding_status = "circuit_open"
     except Exception as e:
         embedding_status = f"unreachable ({str(e)})"
 
     return {
         "status": "healthy",
         "embedding_api_url": AI_SERVICE_BASE_URL,
-        "embedding_api_status": embedding_status
+        "embedding_api_status": embedding_status,
+        "embedding_api_client": face_client.stats(),
+        "schedule_cache": schedule_cache.stats()
     }
\ No newline at end of file
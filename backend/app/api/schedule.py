@@ -1,7 +1,7 @@
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session
-from app.core.db import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.db import get_async_session
 import app.crud.schedule as crud_schedules
 from app.schemas.log import SessionDetailResponse
 
@@ -11,8 +11,8 @@ router = APIRouter(
 )
 
 @router.get("/{schedule_id}")
-def get_schedule_detail(
+async def get_schedule_detail(
     schedule_id: int,
-    db: Session = Depends(get_session)
+    db: AsyncSession = Depends(get_async_session)
 ):
-    return crud_schedules.get_session_data(db, schedule_id)
\ No newline at end of file
+    return await crud_schedules.get_session_data(db, schedule_id)
\ No newline at end of file
@@ -1,10 +1,93 @@
 
-from sqlmodel import create_engine, Session, SQLModel
+import json
+import os
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine, Session, SQLModel, text
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.core.config import DATABASE_URL
-from typing import Generator
+from typing import AsyncGenerator, Generator
+
+try:
+    from pgvector.psycopg2 import register_vector
+except ImportError:
+    register_vector = None
+
+try:
+    from pgvector.asyncpg import register_vector as register_vector_async
+except ImportError:
+    register_vector_async = None
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# prepared statement caches (asyncpg's and SQLAlchemy's) stay off by default:
+# a transaction-mode pooler (Supabase port 6543 / pgbouncer) hands each
+# transaction a different server connection that doesn't have them. Raise it
+# only for a direct or session-mode connection.
+ASYNCPG_STATEMENT_CACHE_SIZE = int(os.getenv("ASYNCPG_STATEMENT_CACHE_SIZE", "0"))
+# opt-in: delete duplicate check-ins (keeping the first) so the unique index on
+# attendance_logs can be built; without it startup stops and lists them instead
+DEDUPE_ATTENDANCE_LOGS = os.getenv("DEDUPE_ATTENDANCE_LOGS", "false").lower() in ("1", "true", "yes")
 
 engine = create_engine(DATABASE_URL, echo=True)
 
+if register_vector is not None:
+    # numpy arrays bind as vector parameters and vector columns load as numpy arrays
+    @event.listens_for(engine, "connect")
+    def _register_vector(dbapi_connection, connection_record):
+        register_vector(dbapi_connection)
+
+def async_database_url(url: str):
+    """
+    DATABASE_URL with the asyncpg driver; asyncpg spells sslmode as ssl.
+    """
+    url = make_url(url).set(drivername="postgresql+asyncpg")
+    sslmode = url.query.get("sslmode")
+    if sslmode:
+        url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": sslmode})
+    return url
+
+# hot request paths (check-in, enrollment, schedule detail) await the database
+# on this engine instead of blocking the event loop
+async_engine = create_async_engine(
+    async_database_url(DATABASE_URL),
+    echo=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    connect_args={
+        "statement_cache_size": ASYNCPG_STATEMENT_CACHE_SIZE,
+        "prepared_statement_cache_size": ASYNCPG_STATEMENT_CACHE_SIZE,
+    },
+)
+
+if register_vector_async is not None and register_vector is not None:
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _register_vector_async(dbapi_connection, connection_record):
+        dbapi_connection.run_async(register_vector_async)
+
+def vector_literal(vector) -> str:
+    # pgvector text form, e.g. '[0.1, 0.2]'
+    return str(np.asarray(vector, dtype=np.float32).tolist())
+
+def to_db_vector(vector):
+    """
+    Query parameter for a pgvector value.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    if register_vector is not None:
+        return vector
+    return vector_literal(vector)
+
+def from_db_vector(value) -> np.ndarray:
+    # a vector column is a numpy array with pgvector registered, its text form otherwise
+    if isinstance(value, str):
+        return np.asarray(json.loads(value), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
 def create_db_and_tables():
 
     from app.models.profile import Profile, Lecturer
@@ -13,9 +96,67 @@ def create_db_and_tables():
     from app.models.enrollment import Enrollment
     from app.models.face_embedding import FaceEmbedding
     from app.models.log import AttendanceLog
+    from app.models.attendance_summary import AttendanceSummary, CourseAttendanceTotal
+
+    with engine.connect() as conn:
+        summaries_existed = conn.execute(text("SELECT to_regclass('attendance_summaries')")).scalar() is not None
 
     SQLModel.metadata.create_all(engine)
+    ensure_db_objects()
+
+    if not summaries_existed:
+        # first start with the summary tables: fill them from the existing logs
+        from app.crud.attendance_summary import rebuild_attendance_summaries
+        with Session(engine) as session:
+            rebuild_attendance_summaries(session)
+
+def ensure_db_objects():
+    """
+    Schema changes create_all does not apply to existing tables.
+    """
+    with engine.begin() as conn:
+        # face_embeddings used to allow a single row per profile
+        conn.execute(text("ALTER TABLE face_embeddings DROP CONSTRAINT IF EXISTS face_embeddings_profile_id_key"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_face_embeddings_profile_id ON face_embeddings (profile_id)"))
+        conn.execute(text("ALTER TABLE courses ADD COLUMN IF NOT EXISTS late_threshold_minutes INTEGER"))
+
+        # check-in used to be check-then-insert, so concurrent requests could log a
+        # student twice; those duplicates block the unique index check-in relies on
+        if conn.execute(text("SELECT to_regclass('ux_attendance_logs_schedule_profile')")).scalar() is None:
+            duplicate_ids = conn.execute(text("""
+                SELECT a.id
+                FROM attendance_logs a
+                WHERE EXISTS (
+                    SELECT 1 FROM attendance_logs b
+                    WHERE b.schedule_id = a.schedule_id
+                      AND b.profile_id = a.profile_id
+                      AND b.id < a.id
+                )
+                ORDER BY a.id
+            """)).scalars().all()
+
+            if duplicate_ids and not DEDUPE_ATTENDANCE_LOGS:
+                raise RuntimeError(
+                    f"attendance_logs has {len(duplicate_ids)} duplicate check-ins (ids {duplicate_ids}); "
+                    "set DEDUPE_ATTENDANCE_LOGS=true to delete them, keeping each student's first log"
+                )
+            if duplicate_ids:
+                conn.execute(text("DELETE FROM attendance_logs WHERE id = ANY(:ids)"), {"ids": duplicate_ids})
+                print(f"--- Warning: Deleted {len(duplicate_ids)} duplicate attendance logs: {duplicate_ids} ---")
+
+            conn.execute(text(
+                "CREATE UNIQUE INDEX ux_attendance_logs_schedule_profile "
+                "ON attendance_logs (schedule_id, profile_id)"
+            ))
 
 def get_session():
     with Session(engine) as session:
-        yield session
\ No newline at end of file
+        yield session
+
+def async_session() -> AsyncSession:
+    # objects stay readable after commit, there is no lazy load on an AsyncSession
+    return AsyncSession(async_engine, expire_on_commit=False)
+
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    async with async_session() as session:
+        yield session
@@ -0,0 +1,49 @@
+"""
+Embedding wire format between backend and face_service.
+
+face_service answers with embeddings as JSON float lists by default. When the
+Accept header asks for a compact media type it sends each one as base64 of its
+little-endian float32 / float16 bytes instead, in the same JSON envelope.
+"""
+import base64
+import os
+from typing import Optional
+
+import numpy as np
+
+EMBEDDING_JSON = "application/json"
+EMBEDDING_F32 = "application/vnd.face-embedding.f32+json"
+EMBEDDING_F16 = "application/vnd.face-embedding.f16+json"
+
+COMPACT_DTYPES = {
+    EMBEDDING_F32: np.dtype("<f4"),
+    EMBEDDING_F16: np.dtype("<f2"),
+}
+
+# "f32" (default), "f16" (half the bytes, ~1e-3 precision) or "json"
+AI_EMBEDDING_ENCODING = os.getenv("AI_EMBEDDING_ENCODING", "f32")
+PREFERRED_MEDIA_TYPE = {
+    "f32": EMBEDDING_F32,
+    "f16": EMBEDDING_F16,
+}.get(AI_EMBEDDING_ENCODING, EMBEDDING_JSON)
+
+# older face_service builds ignore the compact types and answer plain JSON
+ACCEPT_HEADER = (
+    f"{PREFERRED_MEDIA_TYPE}, {EMBEDDING_JSON};q=0.5"
+    if PREFERRED_MEDIA_TYPE != EMBEDDING_JSON else EMBEDDING_JSON
+)
+
+def response_media_type(content_type: Optional[str]) -> str:
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return media_type if media_type in COMPACT_DTYPES else EMBEDDING_JSON
+
+def decode_embedding(value, media_type: str) -> Optional[np.ndarray]:
+    """
+    float32 vector from either wire format; None stays None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        dtype = COMPACT_DTYPES.get(media_type, COMPACT_DTYPES[EMBEDDING_F32])
+        return np.frombuffer(base64.b64decode(value), dtype=dtype).astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
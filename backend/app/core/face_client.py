@@ -0,0 +1,164 @@
+"""
+Application-lifetime HTTP client for backend -> face_service calls.
+
+One pooled httpx.AsyncClient (keep-alive, HTTP/2 when h2 is installed) is
+opened on startup and closed on shutdown. Idempotent calls are retried with
+jittered backoff, and a circuit breaker fails fast while face_service is down
+instead of holding a worker for the full read timeout.
+"""
+import asyncio
+import importlib.util
+import os
+import random
+import time
+from typing import Optional
+
+import httpx
+
+FACE_SERVICE_HTTP2 = os.getenv("FACE_SERVICE_HTTP2", "true").lower() in ("1", "true", "yes")
+FACE_SERVICE_MAX_CONNECTIONS = int(os.getenv("FACE_SERVICE_MAX_CONNECTIONS", "100"))
+FACE_SERVICE_MAX_KEEPALIVE = int(os.getenv("FACE_SERVICE_MAX_KEEPALIVE", "20"))
+FACE_SERVICE_CONNECT_TIMEOUT = float(os.getenv("FACE_SERVICE_CONNECT_TIMEOUT", "2.0"))
+FACE_SERVICE_READ_TIMEOUT = float(os.getenv("FACE_SERVICE_READ_TIMEOUT", "30.0"))
+FACE_SERVICE_RETRIES = int(os.getenv("FACE_SERVICE_RETRIES", "2"))
+FACE_SERVICE_RETRY_BACKOFF = float(os.getenv("FACE_SERVICE_RETRY_BACKOFF", "0.1"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("FACE_SERVICE_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("FACE_SERVICE_BREAKER_RESET_SECONDS", "10"))
+
+# the request never reached face_service, or a pooled keep-alive connection was
+# closed under us; a slow face_service (ReadTimeout) is not retried
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+# 503 is face_service shedding load (with Retry-After): passed straight back
+RETRYABLE_STATUS = {502, 504}
+
+class CircuitOpen(Exception):
+
+    def __init__(self, retry_after: float):
+        super().__init__("face_service circuit is open")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. Once `reset_seconds`
+    have passed, a single trial request is let through (half-open); its
+    outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_request(self):
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return
+        retry_after = max(self.reset_seconds - (time.monotonic() - self.opened_at), 1.0)
+        raise CircuitOpen(retry_after)
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+class FaceServiceClient:
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self._client: Optional[httpx.AsyncClient] = None
+        self.retries = 0
+
+    def start(self):
+        if self._client is not None:
+            return
+
+        http2 = FACE_SERVICE_HTTP2
+        if http2 and importlib.util.find_spec("h2") is None:
+            print("--- Warning: h2 is not installed, face_service client falls back to HTTP/1.1 ---")
+            http2 = False
+
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=FACE_SERVICE_MAX_CONNECTIONS,
+                max_keepalive_connections=FACE_SERVICE_MAX_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(FACE_SERVICE_READ_TIMEOUT, connect=FACE_SERVICE_CONNECT_TIMEOUT),
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, url: str, idempotent: bool = True, **kwargs) -> httpx.Response:
+        """
+        Send a request through the shared pool. Raises CircuitOpen without
+        touching the network while the breaker is open.
+        """
+        self.start()
+        self.breaker.before_request()
+
+        attempts = 1 + (FACE_SERVICE_RETRIES if idempotent else 0)
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            try:
+                response = await self._client.request(method, url, **kwargs)
+            except RETRYABLE_ERRORS:
+                if last_attempt:
+                    self.breaker.record_failure()
+                    raise
+            except asyncio.CancelledError:
+                self.breaker.release_trial()
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    self.breaker.record_success()
+                    return response
+                if last_attempt:
+                    self.breaker.record_failure()
+                    return response
+
+            self.retries += 1
+            # full jitter so retrying workers don't hit face_service in lockstep
+            await asyncio.sleep(random.uniform(0, FACE_SERVICE_RETRY_BACKOFF * (2 ** attempt)))
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "retries": self.retries,
+        }
+
+face_client = FaceServiceClient()
@@ -0,0 +1,376 @@
+"""
+In-memory index of enrolled face embeddings.
+
+All embeddings live in one contiguous float32 matrix next to a profile_id
+array, so a search is a single matrix product instead of a `match_users`
+round trip to Postgres. The database stays the source of truth: the index is
+loaded at startup, refreshed periodically, and updated in place on enroll.
+
+With FACE_INDEX_ENGINE set to ivf/hnsw the global search goes through an ANN
+engine (app.core.vector_engine) that is updated incrementally and, with
+FACE_INDEX_PATH set, persisted so a restart does not rebuild it from scratch.
+"""
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlmodel import Session, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.db import from_db_vector
+from app.core.vector_engine import FACE_INDEX_ENGINE, create_vector_engine, save_npz
+
+FACE_INDEX_ENABLED = os.getenv("FACE_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+FACE_INDEX_REFRESH_SECONDS = int(os.getenv("FACE_INDEX_REFRESH_SECONDS", "300"))
+# "global": nearest face among everyone; "course": only students enrolled in the course
+MATCH_SCOPE = os.getenv("MATCH_SCOPE", "global")
+COURSE_INDEX_TTL_SECONDS = int(os.getenv("COURSE_INDEX_TTL_SECONDS", "300"))
+FACE_INDEX_PATH = os.getenv("FACE_INDEX_PATH", "")
+# "max": every template is indexed, a student matches on their closest one;
+# "centroid": one normalised mean template per student
+TEMPLATE_AGGREGATION = os.getenv("TEMPLATE_AGGREGATION", "max")
+MAX_EMBEDDINGS_PER_PROFILE = int(os.getenv("MAX_EMBEDDINGS_PER_PROFILE", "5"))
+EMBEDDING_DIM = 256
+
+ROSTER_SQL = text("SELECT profile_id FROM enrollments WHERE course_id = :cid")
+
+class FaceMatch(NamedTuple):
+    profile_id: int
+    name: str
+    student_id: Optional[str]
+    distance: float
+
+def aggregate_templates(matrix: np.ndarray, profile_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    One L2-normalised centroid per profile, in order of first appearance.
+    """
+    unique_ids, first, inverse = np.unique(profile_ids, return_index=True, return_inverse=True)
+    sums = np.zeros((len(unique_ids), matrix.shape[1]), dtype=np.float32)
+    np.add.at(sums, inverse, matrix)
+    sums /= np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    order = np.argsort(first)
+    return sums[order], unique_ids[order]
+
+def template_slots(profile_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Position of each row among its profile's templates, and that profile's
+    template count.
+    """
+    if not len(profile_ids):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.argsort(profile_ids, kind="stable")
+    sorted_ids = profile_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_ids)])
+    slots = np.empty(len(profile_ids), dtype=np.int64)
+    totals = np.empty(len(profile_ids), dtype=np.int64)
+    slots[order] = np.arange(len(sorted_ids)) - np.repeat(starts, counts)
+    totals[order] = np.repeat(counts, counts)
+    return slots, totals
+
+def keep_newest_templates(matrix: np.ndarray, profile_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # rows are in insertion order, so the newest templates come last
+    slots, totals = template_slots(profile_ids)
+    keep = slots >= totals - MAX_EMBEDDINGS_PER_PROFILE
+    return matrix[keep], profile_ids[keep]
+
+def template_labels(profile_ids: np.ndarray) -> np.ndarray:
+    """
+    Unique engine label per row: profile_id * MAX_EMBEDDINGS_PER_PROFILE + the
+    row's position among that profile's templates.
+    """
+    return profile_ids * MAX_EMBEDDINGS_PER_PROFILE + template_slots(profile_ids)[0]
+
+class FaceIndex:
+
+    def __init__(
+        self,
+        dim: int = EMBEDDING_DIM,
+        engine: str = FACE_INDEX_ENGINE,
+        path: str = FACE_INDEX_PATH,
+        aggregation: str = TEMPLATE_AGGREGATION,
+    ):
+        self.dim = dim
+        self.path = path
+        self.aggregation = aggregation
+        # None: exact search over the snapshot matrix
+        self.engine = create_vector_engine(engine, dim)
+        self.ready = False
+        self._lock = threading.Lock()
+        # (matrix, squared row norms, profile_ids), swapped as one reference;
+        # a profile has one row per template, or one centroid row
+        self._snapshot = (
+            np.empty((0, dim), dtype=np.float32),
+            np.empty(0, dtype=np.float32),
+            np.empty(0, dtype=np.int64),
+        )
+        self._profiles: Dict[int, Tuple[str, Optional[str]]] = {}
+        self._pending_upserts: Optional[dict] = None
+        # course_id -> (enrolled profile ids, built_at, base snapshot, course snapshot)
+        self._course_cache: Dict[int, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._snapshot[2])
+
+    def load(self, session: Session):
+        with self._lock:
+            # upserts that land while the (slow) load query runs are replayed on top of it
+            self._pending_upserts = {}
+
+        rows = session.execute(text("""
+            SELECT fe.profile_id, fe.embedding, p.name, p.student_id
+            FROM face_embeddings fe
+            JOIN profiles p ON p.id = fe.profile_id
+            ORDER BY fe.profile_id, fe.id
+        """)).fetchall()
+
+        matrix = np.empty((len(rows), self.dim), dtype=np.float32)
+        profile_ids = np.empty(len(rows), dtype=np.int64)
+        profiles = {}
+        for i, row in enumerate(rows):
+            matrix[i] = from_db_vector(row.embedding)
+            profile_ids[i] = row.profile_id
+            profiles[row.profile_id] = (row.name, row.student_id)
+        matrix, profile_ids = keep_newest_templates(matrix, profile_ids)
+        if self.aggregation == "centroid":
+            matrix, profile_ids = aggregate_templates(matrix, profile_ids)
+
+        with self._lock:
+            if self.engine is not None:
+                self._sync_engine(matrix, profile_ids)
+            self._set_arrays(matrix, profile_ids)
+            self._profiles = profiles
+            pending, self._pending_upserts = self._pending_upserts, None
+            for profile_id, (name, student_id, vectors) in pending.items():
+                self._upsert_locked(profile_id, name, student_id, vectors)
+            self.ready = True
+
+        print(f"--- Face index loaded: {len(rows)} embeddings ---")
+        self.save()
+
+    def _sync_engine(self, matrix: np.ndarray, profile_ids: np.ndarray):
+        """
+        Bring the ANN engine in line with freshly loaded rows by adding/removing
+        only what changed, instead of rebuilding it on every refresh.
+        """
+        if not len(self.engine) or self.engine.needs_rebuild():
+            self.engine.build(matrix, template_labels(profile_ids))
+            return
+
+        old_matrix, _, old_profile_ids = self._snapshot
+        labels = template_labels(profile_ids)
+        old_rows = {int(label): i for i, label in enumerate(template_labels(old_profile_ids))}
+        changed = [
+            i for i, label in enumerate(labels)
+            if int(label) not in old_rows or not np.array_equal(old_matrix[old_rows[int(label)]], matrix[i])
+        ]
+        removed = set(old_rows) - {int(label) for label in labels}
+
+        if removed:
+            self.engine.remove(list(removed))
+        if changed:
+            self.engine.add(labels[changed], matrix[changed])
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            matrix, _, profile_ids = self._snapshot
+            names = [self._profiles.get(int(pid), ("", None))[0] for pid in profile_ids]
+            student_ids = [self._profiles.get(int(pid), ("", None))[1] or "" for pid in profile_ids]
+            try:
+                save_npz(self.path, matrix=matrix, profile_ids=profile_ids,
+                         names=np.array(names, dtype=str), student_ids=np.array(student_ids, dtype=str))
+                if self.engine is not None:
+                    self.engine.save(f"{self.path}.{self.engine.name}")
+            except OSError as e:
+                print(f"--- Warning: Failed to save face index to {self.path}: {e} ---")
+
+    def restore(self) -> bool:
+        """
+        Load the index saved by the previous run. The caller still reloads from
+        the database afterwards; that reload only applies the differences.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return False
+
+        with np.load(self.path) as data:
+            matrix, profile_ids = data["matrix"], data["profile_ids"]
+            names, student_ids = data["names"], data["student_ids"]
+        if matrix.shape[1] != self.dim:
+            return False
+
+        with self._lock:
+            if self.engine is not None and not self.engine.load(f"{self.path}.{self.engine.name}"):
+                self.engine.build(matrix, template_labels(profile_ids))
+            self._set_arrays(matrix, profile_ids)
+            self._profiles = {
+                int(pid): (str(name), str(student_id) or None)
+                for pid, name, student_id in zip(profile_ids, names, student_ids)
+            }
+            self.ready = True
+
+        print(f"--- Face index restored from {self.path}: {len(profile_ids)} embeddings ---")
+        return True
+
+    def upsert(self, profile_id: int, name: str, student_id: Optional[str], vectors) -> None:
+        """
+        Replace all templates of a profile with vectors (one or more embeddings).
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)[-MAX_EMBEDDINGS_PER_PROFILE:]
+        if self.aggregation == "centroid" and len(vectors):
+            vectors, _ = aggregate_templates(vectors, np.zeros(len(vectors), dtype=np.int64))
+
+        with self._lock:
+            if self._pending_upserts is not None:
+                self._pending_upserts[profile_id] = (name, student_id, vectors)
+            self._upsert_locked(profile_id, name, student_id, vectors)
+
+    def _upsert_locked(self, profile_id: int, name: str, student_id: Optional[str], vectors: np.ndarray):
+        # copy-on-write so concurrent searches keep a consistent snapshot
+        old_matrix, _, old_profile_ids = self._snapshot
+        keep = old_profile_ids != profile_id
+        matrix = np.concatenate([old_matrix[keep], vectors])
+        profile_ids = np.concatenate([old_profile_ids[keep], np.full(len(vectors), profile_id, dtype=np.int64)])
+        if self.engine is not None:
+            base = profile_id * MAX_EMBEDDINGS_PER_PROFILE
+            self.engine.remove(range(base, base + MAX_EMBEDDINGS_PER_PROFILE))
+            if len(vectors):
+                self.engine.add(base + np.arange(len(vectors)), vectors)
+        self._set_arrays(matrix, profile_ids)
+        self._profiles[profile_id] = (name, student_id)
+
+    def search(self, vector, threshold: float) -> Optional[FaceMatch]:
+        return self.search_many([vector], threshold)[0]
+
+    def search_many(self, vectors: List, threshold: float) -> List[Optional[FaceMatch]]:
+        """
+        Nearest enrolled face (L2 distance, same as match_users) for each query
+        vector, or None when the nearest one is not closer than threshold.
+        """
+        if self.engine is None:
+            return self._search_snapshot(self._snapshot, vectors, threshold)
+        return self._search_engine(vectors, threshold)
+
+    def _search_engine(self, vectors: List, threshold: float) -> List[Optional[FaceMatch]]:
+        if not len(vectors):
+            return []
+
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        labels, sq_dists = self.engine.search(queries, 1)
+
+        matches: List[Optional[FaceMatch]] = []
+        for label, sq_dist in zip(labels[:, 0], sq_dists[:, 0]):
+            distance = float(np.sqrt(max(sq_dist, 0.0)))
+            if label < 0 or distance >= threshold:
+                matches.append(None)
+                continue
+            profile_id = int(label) // MAX_EMBEDDINGS_PER_PROFILE
+            name, student_id = self._profiles.get(profile_id, ("", None))
+            matches.append(FaceMatch(profile_id, name, student_id, distance))
+
+        return matches
+
+    def recall_report(self, sample_size: int = 200, noise: float = 0.05) -> dict:
+        """
+        recall@1 of the ANN engine against exact search. Queries are enrolled
+        embeddings plus gaussian noise, standing in for new captures.
+        """
+        matrix, _, profile_ids = self._snapshot
+        report = {"engine": self.engine.name if self.engine is not None else "exact", "size": len(profile_ids)}
+        if not len(profile_ids):
+            return {**report, "queries": 0, "recall_at_1": None}
+
+        rng = np.random.default_rng(0)
+        rows = rng.choice(len(profile_ids), min(sample_size, len(profile_ids)), replace=False)
+        queries = matrix[rows] + rng.normal(0.0, noise, (len(rows), self.dim)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        started = time.perf_counter()
+        exact = self._search_snapshot(self._snapshot, queries, np.inf)
+        exact_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        approx = self.search_many(queries, np.inf)
+        approx_ms = (time.perf_counter() - started) * 1000
+
+        hits = sum(1 for e, a in zip(exact, approx) if a is not None and a.profile_id == e.profile_id)
+        return {
+            **report,
+            "queries": len(rows),
+            "recall_at_1": hits / len(rows),
+            "exact_ms_per_query": exact_ms / len(rows),
+            "engine_ms_per_query": approx_ms / len(rows),
+        }
+
+    async def asearch_in_course(self, session: AsyncSession, course_id: int, vectors: List, threshold: float) -> List[Optional[FaceMatch]]:
+        """
+        Same as search_many, restricted to students enrolled in the course.
+        """
+        roster = self._cached_roster(course_id)
+        if roster is None:
+            rows = (await session.execute(ROSTER_SQL, {"cid": course_id})).fetchall()
+            roster = self._new_roster(rows)
+        return self._search_snapshot(self._course_snapshot(course_id, roster), vectors, threshold)
+
+    def invalidate_course(self, course_id: int):
+        self._course_cache.pop(course_id, None)
+
+    def _cached_roster(self, course_id: int) -> Optional[tuple]:
+        # (enrolled profile ids, fetched at) while younger than the TTL
+        cached = self._course_cache.get(course_id)
+        if cached is not None and time.monotonic() - cached[1] < COURSE_INDEX_TTL_SECONDS:
+            return cached[0], cached[1]
+        return None
+
+    @staticmethod
+    def _new_roster(rows) -> tuple:
+        return np.array([row.profile_id for row in rows], dtype=np.int64), time.monotonic()
+
+    def _course_snapshot(self, course_id: int, roster: tuple) -> tuple:
+        base = self._snapshot
+        enrolled, built_at = roster
+        cached = self._course_cache.get(course_id)
+        if cached is not None and cached[0] is enrolled and cached[2] is base:
+            return cached[3]
+
+        # the roster is unchanged but the global index moved: re-slice without the DB
+        matrix, sq_norms, profile_ids = base
+        mask = np.isin(profile_ids, enrolled)
+        course_snapshot = (np.ascontiguousarray(matrix[mask]), sq_norms[mask], profile_ids[mask])
+        self._course_cache[course_id] = (enrolled, built_at, base, course_snapshot)
+        return course_snapshot
+
+    def _search_snapshot(self, snapshot: tuple, vectors: List, threshold: float) -> List[Optional[FaceMatch]]:
+        matrix, sq_norms, profile_ids = snapshot
+        if not len(vectors):
+            return []
+        if not len(profile_ids):
+            return [None] * len(vectors)
+
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        # |m - q|^2 = |m|^2 - 2 m.q + |q|^2 ; the argmin does not need |q|^2
+        scores = sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+        best = scores.argmin(axis=1)
+        sq_dist = scores[np.arange(len(queries)), best] + np.einsum("ij,ij->i", queries, queries)
+        distances = np.sqrt(np.maximum(sq_dist, 0.0))
+
+        matches: List[Optional[FaceMatch]] = []
+        for idx, distance in zip(best, distances):
+            if distance >= threshold:
+                matches.append(None)
+                continue
+            profile_id = int(profile_ids[idx])
+            name, student_id = self._profiles.get(profile_id, ("", None))
+            matches.append(FaceMatch(profile_id, name, student_id, float(distance)))
+
+        return matches
+
+    def _set_arrays(self, matrix: np.ndarray, profile_ids: np.ndarray):
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+        self._snapshot = (matrix, sq_norms, np.asarray(profile_ids, dtype=np.int64))
+
+face_index = FaceIndex()
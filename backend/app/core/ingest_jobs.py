@@ -0,0 +1,350 @@
+"""
+Background queue for enrollment imports (roster files and OCR of list photos).
+
+Uploads are spooled to disk and recorded in a SQLite job table; the request
+returns the job id immediately and a small pool of workers in the API process
+claims and runs the jobs, recording progress that clients poll through
+GET /enrollments/jobs/{job_id}.
+
+Jobs are keyed on (kind, course, SHA-256 of the file): uploading the same file
+again returns the existing job instead of importing it twice, and only a
+failed job is re-queued. The table survives restarts as long as
+INGEST_DATA_DIR is on persistent storage (docker-compose mounts a volume
+there). On shutdown, running jobs stop at their next checkpoint and go back to
+the queue; a job left running by a worker that died without shutting down is
+picked up again once it stops reporting progress.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+# the job table and the uploads it points to; not /tmp, which a container
+# restart clears along with every queued job
+INGEST_DATA_DIR = os.getenv(
+    "INGEST_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data"),
+)
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", os.path.join(INGEST_DATA_DIR, "uploads"))
+INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", os.path.join(INGEST_DATA_DIR, "enrollment_jobs.sqlite3"))
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "2000"))
+INGEST_UPLOAD_BLOCK_BYTES = int(os.getenv("INGEST_UPLOAD_BLOCK_KB", "1024")) * 1024
+# jobs run at the same time in this process (OCR calls and DB writes included)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "2"))
+# a running job without progress for this long is assumed orphaned and re-queued
+INGEST_STALE_SECONDS = float(os.getenv("INGEST_STALE_SECONDS", "300"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_RETENTION_HOURS = float(os.getenv("INGEST_RETENTION_HOURS", "168"))
+
+COLUMNS = (
+    "id", "kind", "course_id", "filename", "content_type", "path", "file_hash",
+    "status", "error", "attempts",
+    "chunks", "rows_read", "students_found", "enrolled", "profiles_created",
+    "created_at", "started_at", "finished_at", "updated_at",
+)
+PROGRESS_COLUMNS = ("chunks", "rows_read", "students_found", "enrolled", "profiles_created")
+
+class IngestJob:
+
+    def __init__(self, **fields):
+        for name in COLUMNS:
+            setattr(self, name, fields.get(name))
+        for name in PROGRESS_COLUMNS + ("attempts",):
+            setattr(self, name, getattr(self, name) or 0)
+
+    @classmethod
+    def from_row(cls, row) -> "IngestJob":
+        return cls(**dict(zip(COLUMNS, row)))
+
+    def start(self):
+        self.status = "running"
+        self.started_at = time.time()
+
+    def finish(self, error: Optional[str] = None):
+        self.status = "failed" if error else "done"
+        self.error = error
+        self.finished_at = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "course_id": self.course_id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "attempts": self.attempts,
+            "chunks": self.chunks,
+            "rows_read": self.rows_read,
+            "students_found": self.students_found,
+            "enrolled": self.enrolled,
+            "profiles_created": self.profiles_created,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+JobHandler = Callable[[IngestJob], Awaitable[None]]
+
+class IngestInterrupted(Exception):
+    """
+    Raised at a checkpoint once the queue is shutting down.
+    """
+
+def remove_spool_file(path: Optional[str]):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"--- Warning: Failed to remove spooled upload {path}: {e} ---")
+
+class IngestQueue:
+
+    def __init__(self, path: str = INGEST_QUEUE_PATH, workers: int = INGEST_WORKERS):
+        self.path = path
+        self.workers = workers
+        self.handlers: Dict[str, JobHandler] = {}
+        self._local = threading.local()
+        self._tasks = []
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = threading.Event()
+        # claimed by this process and not finished yet, requeued on shutdown
+        self._running: Dict[str, IngestJob] = {}
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # autocommit; transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS ingest_jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    course_id INTEGER NOT NULL,
+                    filename TEXT,
+                    content_type TEXT,
+                    path TEXT,
+                    file_hash TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    {", ".join(f"{name} INTEGER NOT NULL DEFAULT 0" for name in PROGRESS_COLUMNS)},
+                    created_at REAL,
+                    started_at REAL,
+                    finished_at REAL,
+                    updated_at REAL
+                )
+            """)
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ux_ingest_jobs_key ON ingest_jobs (kind, course_id, file_hash)"
+            )
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers (or
+        # two API processes) can't claim the same job
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _select(self, conn: sqlite3.Connection, where: str, params: tuple) -> Optional[IngestJob]:
+        row = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM ingest_jobs WHERE {where}", params).fetchone()
+        return IngestJob.from_row(row) if row else None
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self._select(self._conn(), "id = ?", (job_id,))
+
+    def _submit(self, kind: str, course_id: int, filename: str, content_type: str, path: str, file_hash: str) -> Tuple[IngestJob, bool]:
+        now = time.time()
+        with self._transaction() as conn:
+            job = self._select(conn, "kind = ? AND course_id = ? AND file_hash = ?", (kind, course_id, file_hash))
+            if job is not None and job.status != "failed":
+                return job, False
+
+            if job is None:
+                job = IngestJob(id=uuid.uuid4().hex, kind=kind, course_id=course_id, file_hash=file_hash, created_at=now)
+                conn.execute(
+                    "INSERT INTO ingest_jobs (id, kind, course_id, file_hash, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                    (job.id, kind, course_id, file_hash, now)
+                )
+
+            # a new job, or a retry of a failed one with the freshly uploaded file
+            conn.execute(f"""
+                UPDATE ingest_jobs
+                SET status = 'queued', error = NULL, attempts = 0,
+                    filename = ?, content_type = ?, path = ?,
+                    {", ".join(f"{name} = 0" for name in PROGRESS_COLUMNS)},
+                    started_at = NULL, finished_at = NULL, updated_at = ?
+                WHERE id = ?
+            """, (filename, content_type, path, now, job.id))
+            return self._select(conn, "id = ?", (job.id,)), True
+
+    async def submit(self, kind: str, course_id: int, filename: str, content_type: str, path: str, file_hash: str) -> Tuple[IngestJob, bool]:
+        """
+        (job, created). created is False when the same file is already queued,
+        running or imported for the course; that job is returned unchanged.
+        """
+        job, created = await asyncio.to_thread(self._submit, kind, course_id, filename, content_type, path, file_hash)
+        if created and self._wake is not None:
+            self._wake.set()
+        return job, created
+
+    def save(self, job: IngestJob):
+        """
+        Persist status and progress; also the worker's heartbeat.
+        """
+        job.updated_at = time.time()
+        self._conn().execute(f"""
+            UPDATE ingest_jobs
+            SET status = ?, error = ?, attempts = ?,
+                {", ".join(f"{name} = ?" for name in PROGRESS_COLUMNS)},
+                started_at = ?, finished_at = ?, updated_at = ?
+            WHERE id = ?
+        """, (
+            job.status, job.error, job.attempts,
+            *(getattr(job, name) for name in PROGRESS_COLUMNS),
+            job.started_at, job.finished_at, job.updated_at, job.id,
+        ))
+
+    def claim(self) -> Optional[IngestJob]:
+        while True:
+            with self._transaction() as conn:
+                job = self._select(
+                    conn,
+                    "status = 'queued' OR (status = 'running' AND updated_at < ?) ORDER BY created_at LIMIT 1",
+                    (time.time() - INGEST_STALE_SECONDS,)
+                )
+                if job is None:
+                    return None
+
+                job.attempts += 1
+                given_up = job.attempts > INGEST_MAX_ATTEMPTS
+                if given_up:
+                    job.finish(error="Vượt quá số lần thử, hãy gửi lại file")
+                else:
+                    job.start()
+                    for name in PROGRESS_COLUMNS:
+                        setattr(job, name, 0)
+                self.save(job)
+
+            if not given_up:
+                self._running[job.id] = job
+                if self._stopping.is_set() and self._running.pop(job.id, None) is not None:
+                    # stop() began while this claim was in flight
+                    self._requeue(job)
+                    return None
+                return job
+            remove_spool_file(job.path)
+
+    def checkpoint(self, job: IngestJob):
+        """
+        save() between units of work; raises IngestInterrupted once the queue
+        is stopping, so a handler running in a thread ends early instead of
+        outliving the shutdown. Handlers must be safe to run again from the start.
+        """
+        if self._stopping.is_set():
+            raise IngestInterrupted(job.id)
+        self.save(job)
+
+    def _requeue(self, job: IngestJob):
+        job.status = "queued"
+        job.attempts -= 1
+        self.save(job)
+
+    def purge(self):
+        with self._transaction() as conn:
+            where = "finished_at IS NOT NULL AND finished_at < ?"
+            params = (time.time() - INGEST_RETENTION_HOURS * 3600,)
+            paths = [row[0] for row in conn.execute(f"SELECT path FROM ingest_jobs WHERE {where}", params)]
+            conn.execute(f"DELETE FROM ingest_jobs WHERE {where}", params)
+        for path in paths:
+            remove_spool_file(path)
+
+    def start(self, handlers: Dict[str, JobHandler]):
+        """
+        Start the worker pool on the running event loop.
+        """
+        self.handlers = handlers
+        self._wake = asyncio.Event()
+        self._stopping.clear()
+        os.makedirs(INGEST_SPOOL_DIR, exist_ok=True)
+        try:
+            self.purge()
+        except sqlite3.Error as e:
+            print(f"--- Warning: Failed to purge old ingest jobs: {e} ---")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # claimed but never handed to _run (the worker was cancelled while the
+        # claim was still in its thread): back to the queue as well
+        while self._running:
+            _, job = self._running.popitem()
+            try:
+                self._requeue(job)
+            except sqlite3.Error as e:
+                print(f"--- Warning: Failed to requeue ingest job {job.id}: {e} ---")
+
+    async def _worker(self):
+        while True:
+            self._wake.clear()
+            try:
+                job = await asyncio.to_thread(self.claim)
+            except sqlite3.Error as e:
+                print(f"--- Warning: Ingest queue unavailable: {e} ---")
+                job = None
+
+            if job is None:
+                try:
+                    # jobs submitted by other processes are seen on the next poll
+                    await asyncio.wait_for(self._wake.wait(), INGEST_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def _run(self, job: IngestJob):
+        handler = self.handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job.kind}")
+            await handler(job)
+            job.finish()
+        except asyncio.CancelledError:
+            # shutting down: leave the job and its file for the next start, saved
+            # without awaiting; the handler's thread stops at its next checkpoint
+            if self._running.pop(job.id, None) is not None:
+                self._requeue(job)
+            raise
+        except Exception as e:
+            # HTTPException carries the user-facing message in detail
+            job.finish(error=str(getattr(e, "detail", None) or e))
+
+        self._running.pop(job.id, None)
+        await asyncio.to_thread(self.save, job)
+        remove_spool_file(job.path)
+
+ingest_queue = IngestQueue()
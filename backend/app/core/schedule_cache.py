@@ -0,0 +1,174 @@
+"""
+In-process cache of active and upcoming schedules.
+
+Check-in needs the session running right now for a course and its late window.
+Schedules change only when a course is created, so instead of querying
+`schedules` on every check-in the ones overlapping [now, now + horizon] are
+kept per course, sorted by start time. The cache is authoritative for any
+instant inside the loaded window; outside it, or once it is older than the
+refresh interval, the next lookup reloads it.
+"""
+import asyncio
+import bisect
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlmodel import Session, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+SCHEDULE_CACHE_ENABLED = os.getenv("SCHEDULE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SCHEDULE_CACHE_REFRESH_SECONDS = int(os.getenv("SCHEDULE_CACHE_REFRESH_SECONDS", "60"))
+SCHEDULE_CACHE_HORIZON_HOURS = int(os.getenv("SCHEDULE_CACHE_HORIZON_HOURS", "24"))
+# used for courses without their own late_threshold_minutes
+LATE_THRESHOLD_MINUTES = int(os.getenv("LATE_THRESHOLD_MINUTES", "10"))
+
+SCHEDULE_COLUMNS = """
+    s.id, s.course_id, s.start_time, s.end_time,
+    COALESCE(c.late_threshold_minutes, :default_late) AS late_threshold_minutes
+"""
+
+class ActiveSchedule(NamedTuple):
+    id: int
+    course_id: int
+    start_time: datetime
+    end_time: datetime
+    late_threshold: timedelta
+
+def _as_utc(value: datetime) -> datetime:
+    # schedules are stored as timestamp without time zone, in UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+def db_time(value: datetime) -> datetime:
+    # naive UTC to match the column; asyncpg refuses aware values for timestamp
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def _to_schedule(row) -> ActiveSchedule:
+    return ActiveSchedule(
+        id=row.id,
+        course_id=row.course_id,
+        start_time=_as_utc(row.start_time),
+        end_time=_as_utc(row.end_time),
+        late_threshold=timedelta(minutes=row.late_threshold_minutes),
+    )
+
+ACTIVE_SCHEDULE_SQL = text(f"""
+    SELECT {SCHEDULE_COLUMNS}
+    FROM schedules s
+    JOIN courses c ON c.id = s.course_id
+    WHERE s.course_id = :cid
+      AND s.start_time <= :now
+      AND s.end_time >= :now
+    ORDER BY s.start_time DESC
+    LIMIT 1
+""")
+
+WINDOW_SQL = text(f"""
+    SELECT {SCHEDULE_COLUMNS}
+    FROM schedules s
+    JOIN courses c ON c.id = s.course_id
+    WHERE s.end_time >= :now
+      AND s.start_time <= :until
+    ORDER BY s.course_id, s.start_time
+""")
+
+def _active_params(course_id: int, now: datetime) -> dict:
+    return {"cid": course_id, "now": db_time(now), "default_late": LATE_THRESHOLD_MINUTES}
+
+async def aquery_active_schedule(session: AsyncSession, course_id: int, now: datetime) -> Optional[ActiveSchedule]:
+    row = (await session.execute(ACTIVE_SCHEDULE_SQL, _active_params(course_id, now))).fetchone()
+    return _to_schedule(row) if row else None
+
+class ScheduleCache:
+
+    def __init__(self, enabled: bool = SCHEDULE_CACHE_ENABLED):
+        self.enabled = enabled
+        # reloads from the event loop: a thread lock held across an await would block it
+        self._async_lock = asyncio.Lock()
+        # course_id -> (start times, schedules) sorted by start time, swapped as one reference
+        self._by_course: Dict[int, Tuple[List[datetime], List[ActiveSchedule]]] = {}
+        self._window: Optional[Tuple[datetime, datetime]] = None
+        self._loaded_at = 0.0
+
+        self.hits = 0
+        self.reloads = 0
+
+    def invalidate(self):
+        self._window = None
+
+    @staticmethod
+    def _window_params(now: datetime) -> dict:
+        until = now + timedelta(hours=SCHEDULE_CACHE_HORIZON_HOURS)
+        return {"now": db_time(now), "until": db_time(until), "default_late": LATE_THRESHOLD_MINUTES}
+
+    def load(self, session: Session, now: Optional[datetime] = None):
+        now = now or datetime.now(timezone.utc)
+        rows = session.execute(WINDOW_SQL, self._window_params(now)).fetchall()
+        self._install(rows, now)
+
+    async def aload(self, session: AsyncSession, now: Optional[datetime] = None):
+        now = now or datetime.now(timezone.utc)
+        rows = (await session.execute(WINDOW_SQL, self._window_params(now))).fetchall()
+        self._install(rows, now)
+
+    def _install(self, rows, now: datetime):
+        until = now + timedelta(hours=SCHEDULE_CACHE_HORIZON_HOURS)
+        by_course: Dict[int, Tuple[List[datetime], List[ActiveSchedule]]] = {}
+        for row in rows:
+            schedule = _to_schedule(row)
+            starts, schedules = by_course.setdefault(schedule.course_id, ([], []))
+            starts.append(schedule.start_time)
+            schedules.append(schedule)
+
+        self._by_course = by_course
+        self._window = (now, until)
+        self._loaded_at = time.monotonic()
+        self.reloads += 1
+
+    def _covers(self, now: datetime) -> bool:
+        window = self._window
+        return (
+            window is not None
+            and window[0] <= now <= window[1]
+            and time.monotonic() - self._loaded_at < SCHEDULE_CACHE_REFRESH_SECONDS
+        )
+
+    async def alookup(self, session: AsyncSession, course_id: int, now: datetime) -> Optional[ActiveSchedule]:
+        """
+        Session of the course running at `now`, or None.
+        """
+        if not self.enabled:
+            return await aquery_active_schedule(session, course_id, now)
+
+        if not self._covers(now):
+            async with self._async_lock:
+                if not self._covers(now):
+                    await self.aload(session, now)
+        else:
+            self.hits += 1
+
+        return self._find(course_id, now)
+
+    def _find(self, course_id: int, now: datetime) -> Optional[ActiveSchedule]:
+        starts, schedules = self._by_course.get(course_id, ([], []))
+        # latest session that has started, walking back over overlapping ones
+        i = bisect.bisect_right(starts, now)
+        while i > 0:
+            i -= 1
+            if schedules[i].end_time >= now:
+                return schedules[i]
+        return None
+
+    def stats(self) -> dict:
+        window = self._window
+        return {
+            "enabled": self.enabled,
+            "courses": len(self._by_course),
+            "schedules": sum(len(schedules) for _, schedules in self._by_course.values()),
+            "window": [window[0].isoformat(), window[1].isoformat()] if window else None,
+            "hits": self.hits,
+            "reloads": self.reloads,
+        }
+
+schedule_cache = ScheduleCache()
@@ -0,0 +1,289 @@
+"""
+Approximate nearest-neighbour engines for the face index.
+
+Brute force over every enrolled face is fine for a few thousand students; for
+campus-wide deployments FaceIndex can hand the global search to one of these:
+
+- "ivf":  pure NumPy inverted file (k-means coarse quantizer, nprobe lists)
+- "hnsw": hnswlib graph index, when hnswlib is installed
+
+Both take profile ids as labels, support add (which also replaces) and remove,
+and persist to a local file. Returned distances are squared L2.
+"""
+import os
+import threading
+from typing import Callable, Tuple
+
+import numpy as np
+
+FACE_INDEX_ENGINE = os.getenv("FACE_INDEX_ENGINE", "exact")
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0: ~sqrt(n)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_TRAIN_ITERS = int(os.getenv("IVF_TRAIN_ITERS", "10"))
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+def atomic_write(path: str, write: Callable[[str], None]):
+    """
+    write(tmp_path), then rename it over path: a crash mid-write leaves the
+    previous file intact instead of a torn one.
+    """
+    tmp = f"{path}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def save_npz(path: str, **arrays):
+    # through a file handle: np.savez appends ".npz" to a bare path name
+    def write(tmp: str):
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+    atomic_write(path, write)
+
+class IVFEngine:
+    name = "ivf"
+
+    def __init__(self, dim: int, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        # (centroids, [(ids, vectors) per list]); lists are replaced, never mutated
+        self._state = (np.empty((0, dim), dtype=np.float32), [])
+        self._where = {}
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def needs_rebuild(self) -> bool:
+        # centroids trained on a much smaller population give lopsided lists
+        return len(self) > 4 * max(self._trained_size, 256)
+
+    def build(self, matrix: np.ndarray, ids: np.ndarray):
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        nlist = self.nlist or max(1, int(np.sqrt(len(ids))))
+        nlist = min(nlist, max(1, len(ids)))
+
+        centroids = self._train(matrix, nlist)
+        assign = self._nearest_centroid(centroids, matrix)
+        lists = [(ids[assign == c], matrix[assign == c]) for c in range(len(centroids))]
+
+        self._state = (centroids, lists)
+        self._where = {int(pid): int(c) for pid, c in zip(ids, assign)}
+        self._trained_size = len(ids)
+
+    def _train(self, matrix: np.ndarray, nlist: int) -> np.ndarray:
+        if not len(matrix):
+            return np.zeros((1, self.dim), dtype=np.float32)
+
+        rng = np.random.default_rng(0)
+        sample = matrix
+        if len(matrix) > 256 * nlist:
+            sample = matrix[rng.choice(len(matrix), 256 * nlist, replace=False)]
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(IVF_TRAIN_ITERS):
+            assign = self._nearest_centroid(centroids, sample)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        return centroids
+
+    @staticmethod
+    def _nearest_centroid(centroids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        scores = np.einsum("ij,ij->i", centroids, centroids)[None, :] - 2.0 * (vectors @ centroids.T)
+        return scores.argmin(axis=1)
+
+    def add(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if not len(self._state[0]):
+            self.build(vectors, ids)
+            return
+        self.remove(ids)
+        centroids, lists = self._state
+        lists = list(lists)
+        for pid, c, vector in zip(ids, self._nearest_centroid(centroids, vectors), vectors):
+            list_ids, list_vectors = lists[c]
+            lists[c] = (np.append(list_ids, int(pid)), np.vstack([list_vectors, vector[None, :]]))
+            self._where[int(pid)] = int(c)
+        self._state = (centroids, lists)
+
+    def remove(self, ids):
+        centroids, lists = self._state
+        lists = list(lists)
+        for pid in ids:
+            c = self._where.pop(int(pid), None)
+            if c is None:
+                continue
+            list_ids, list_vectors = lists[c]
+            keep = list_ids != int(pid)
+            lists[c] = (list_ids[keep], list_vectors[keep])
+        self._state = (centroids, lists)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        centroids, lists = self._state
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        if not lists:
+            return labels, distances
+
+        nprobe = min(self.nprobe, len(centroids))
+        centroid_scores = np.einsum("ij,ij->i", centroids, centroids)[None, :] - 2.0 * (queries @ centroids.T)
+        probes = np.argpartition(centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        for i, query in enumerate(queries):
+            chunks = [lists[c] for c in probes[i] if len(lists[c][0])]
+            if not chunks:
+                continue
+            ids = np.concatenate([chunk[0] for chunk in chunks])
+            vectors = np.concatenate([chunk[1] for chunk in chunks])
+            diff = vectors - query
+            sq_dist = np.einsum("ij,ij->i", diff, diff)
+            top = np.argsort(sq_dist)[:k]
+            labels[i, :len(top)] = ids[top]
+            distances[i, :len(top)] = sq_dist[top]
+
+        return labels, distances
+
+    def save(self, path: str):
+        centroids, lists = self._state
+        save_npz(
+            path,
+            centroids=centroids,
+            ids=np.concatenate([chunk[0] for chunk in lists]) if lists else np.empty(0, dtype=np.int64),
+            vectors=np.concatenate([chunk[1] for chunk in lists]) if lists else np.empty((0, self.dim), dtype=np.float32),
+            assign=np.concatenate([np.full(len(chunk[0]), c) for c, chunk in enumerate(lists)]) if lists else np.empty(0, dtype=np.int64),
+            trained_size=self._trained_size,
+        )
+
+    def load(self, path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            centroids, ids, vectors, assign = data["centroids"], data["ids"], data["vectors"], data["assign"]
+            self._trained_size = int(data["trained_size"])
+        if centroids.shape[1] != self.dim:
+            return False
+
+        self._state = (centroids, [(ids[assign == c], vectors[assign == c]) for c in range(len(centroids))])
+        self._where = {int(pid): int(c) for pid, c in zip(ids, assign)}
+        return True
+
+class HNSWEngine:
+    name = "hnsw"
+
+    def __init__(self, dim: int):
+        import hnswlib
+
+        self.dim = dim
+        self._hnswlib = hnswlib
+        self._index = None
+        self._live = set()
+        # resize_index / mark_deleted are not safe to run next to knn_query
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def needs_rebuild(self) -> bool:
+        # deleted nodes stay in the graph; rebuild once they dominate it
+        return self._index is not None and self._index.get_current_count() > 2 * max(len(self._live), 1024)
+
+    def _new_index(self, capacity: int):
+        index = self._hnswlib.Index(space="l2", dim=self.dim)
+        index.init_index(max_elements=max(capacity, 1024), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        index.set_ef(HNSW_EF_SEARCH)
+        index.set_num_threads(1)
+        return index
+
+    def build(self, matrix: np.ndarray, ids: np.ndarray):
+        index = self._new_index(2 * len(ids))
+        if len(ids):
+            index.add_items(np.asarray(matrix, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+        with self._lock:
+            self._index = index
+            self._live = {int(pid) for pid in ids}
+
+    def add(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            if self._index is None:
+                self._index = self._new_index(2 * len(ids))
+            needed = self._index.get_current_count() + len(ids)
+            if needed > self._index.get_max_elements():
+                self._index.resize_index(2 * needed)
+            # an existing label (even a deleted one) is updated in place and un-deleted
+            self._index.add_items(vectors, np.asarray(ids, dtype=np.int64))
+            self._live.update(int(pid) for pid in ids)
+
+    def remove(self, ids):
+        with self._lock:
+            for pid in ids:
+                if int(pid) in self._live:
+                    self._index.mark_deleted(int(pid))
+                    self._live.discard(int(pid))
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+
+        with self._lock:
+            available = min(k, len(self._live))
+            if not available:
+                return labels, distances
+            self._index.set_ef(max(HNSW_EF_SEARCH, available))
+            found_labels, found_distances = self._index.knn_query(queries, k=available)
+
+        labels[:, :available] = found_labels
+        distances[:, :available] = found_distances
+        return labels, distances
+
+    def save(self, path: str):
+        with self._lock:
+            if self._index is None:
+                return
+            ids = np.fromiter(self._live, dtype=np.int64, count=len(self._live))
+
+            def write_ids(tmp: str):
+                with open(tmp, "wb") as f:
+                    np.save(f, ids)
+
+            atomic_write(f"{path}.ids.npy", write_ids)
+            atomic_write(path, self._index.save_index)
+
+    def load(self, path: str) -> bool:
+        if not (os.path.exists(path) and os.path.exists(f"{path}.ids.npy")):
+            return False
+        index = self._hnswlib.Index(space="l2", dim=self.dim)
+        index.load_index(path)
+        index.set_ef(HNSW_EF_SEARCH)
+        index.set_num_threads(1)
+        live = {int(pid) for pid in np.load(f"{path}.ids.npy")}
+        with self._lock:
+            self._index = index
+            self._live = live
+        return True
+
+def create_vector_engine(name: str, dim: int):
+    """
+    Engine for global face search, or None for exact brute force.
+    "auto" picks hnsw when hnswlib is installed, ivf otherwise.
+    """
+    if name == "exact":
+        return None
+    if name in ("hnsw", "auto"):
+        try:
+            return HNSWEngine(dim)
+        except ImportError:
+            if name == "hnsw":
+                print("--- Warning: hnswlib is not installed, using the NumPy IVF engine ---")
+    if name in ("ivf", "hnsw", "auto"):
+        return IVFEngine(dim)
+    raise ValueError(f"Unknown FACE_INDEX_ENGINE: {name}")
@@ -0,0 +1,120 @@
+"""
+Per-(course, student) attendance counts kept next to attendance_logs.
+
+Check-in increments attendance_summaries in the same statement that inserts
+the log, and creating a course's schedules increments
+course_attendance_totals, so enrollment search reads one row per student
+instead of re-aggregating the logs. Anything written around those paths
+(manual edits, direct Supabase writes) is corrected by a rebuild:
+
+    python -m app.crud.attendance_summary [--course-id ID]
+"""
+import argparse
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import DateTime, literal
+from sqlmodel import Session, func, select, text
+
+from app.core.schedule_cache import db_time
+from app.models import Schedule
+
+# appended to a check-in CTE whose `ins` step returns (profile_id, status) of
+# the logs actually inserted; :cid is the course
+CHECK_IN_SUMMARY_CTE = """
+        summary AS (
+            INSERT INTO attendance_summaries (course_id, profile_id, attended, late)
+            SELECT CAST(:cid AS integer), profile_id, 1, CASE WHEN status = 'late' THEN 1 ELSE 0 END
+            FROM ins
+            ON CONFLICT (course_id, profile_id) DO UPDATE
+            SET attended = attendance_summaries.attended + EXCLUDED.attended,
+                late = attendance_summaries.late + EXCLUDED.late
+        )"""
+
+def add_course_sessions(db: Session, course_id: int, count: int):
+    """
+    Count newly generated schedules; committed by the caller with the schedules.
+    """
+    db.execute(text("""
+        INSERT INTO course_attendance_totals (course_id, total_sessions)
+        VALUES (:cid, :count)
+        ON CONFLICT (course_id) DO UPDATE
+        SET total_sessions = course_attendance_totals.total_sessions + EXCLUDED.total_sessions
+    """), {"cid": course_id, "count": count})
+
+def held_sessions(course_id: Optional[int] = None, now: Optional[datetime] = None):
+    """
+    Subquery (course_id, held): schedules that have already started. Absences
+    and the attendance rate are counted against these, not the whole term.
+    """
+    # bound as a plain naive-UTC DateTime: asyncpg refuses aware values for the
+    # timestamp column, and the model's UTCDateTime type refuses naive ones
+    started_by = literal(db_time(now or datetime.now(timezone.utc)), DateTime())
+    statement = select(Schedule.course_id, func.count().label("held")).where(Schedule.start_time <= started_by)
+    if course_id is not None:
+        statement = statement.where(Schedule.course_id == course_id)
+    return statement.group_by(Schedule.course_id).subquery()
+
+def attendance_counts(attended: Optional[int], late: Optional[int], held: Optional[int]) -> dict:
+    attended = attended or 0
+    held = held or 0
+    return {
+        "attended_count": attended,
+        "late_count": late or 0,
+        "absent_count": max(held - attended, 0),
+        "held_sessions": held,
+        "attendance_rate": round(attended / held * 100, 1) if held > 0 else 0.0,
+    }
+
+def rebuild_attendance_summaries(db: Session, course_id: Optional[int] = None) -> dict:
+    """
+    Recompute summaries and session totals from attendance_logs and schedules,
+    for one course or all of them, in one transaction.
+    """
+    course_filter = "AND s.course_id = :cid" if course_id is not None else ""
+    params = {"cid": course_id}
+
+    try:
+        # check-ins wait for the rebuild instead of incrementing rows it is replacing
+        db.execute(text("LOCK TABLE attendance_summaries, course_attendance_totals IN EXCLUSIVE MODE"))
+
+        db.execute(text(
+            "DELETE FROM attendance_summaries" + (" WHERE course_id = :cid" if course_id is not None else "")
+        ), params)
+        summaries = db.execute(text(f"""
+            INSERT INTO attendance_summaries (course_id, profile_id, attended, late)
+            SELECT s.course_id, a.profile_id, count(*), count(*) FILTER (WHERE a.status = 'late')
+            FROM attendance_logs a
+            JOIN schedules s ON s.id = a.schedule_id
+            WHERE a.status IN ('present', 'late') {course_filter}
+            GROUP BY s.course_id, a.profile_id
+        """), params).rowcount
+
+        db.execute(text(
+            "DELETE FROM course_attendance_totals" + (" WHERE course_id = :cid" if course_id is not None else "")
+        ), params)
+        courses = db.execute(text(f"""
+            INSERT INTO course_attendance_totals (course_id, total_sessions)
+            SELECT s.course_id, count(*)
+            FROM schedules s
+            WHERE TRUE {course_filter}
+            GROUP BY s.course_id
+        """), params).rowcount
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return {"summaries": summaries, "courses": courses}
+
+if __name__ == "__main__":
+    from app.core.db import engine
+
+    parser = argparse.ArgumentParser(description="Rebuild attendance summaries from attendance_logs")
+    parser.add_argument("--course-id", type=int, default=None, help="only this course")
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        result = rebuild_attendance_summaries(session, args.course_id)
+    print(f"Rebuilt {result['summaries']} attendance summaries for {result['courses']} courses")
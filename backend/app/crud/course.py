@@ -8,6 +8,8 @@ from app.models.course import Course
 from app.models.schedule import Schedule
 from app.models.profile import Profile, Lecturer
 from app.schemas.course import CourseCreateRequest
+from app.core.schedule_cache import schedule_cache
+from app.crud.attendance_summary import add_course_sessions
 
 def create_course(db: Session, course: CourseCreateRequest):
     try:
@@ -30,7 +32,9 @@ def create_course(db: Session, course: CourseCreateRequest):
                 schedules_to_add.append(schedule)
 
             db.add_all(schedules_to_add)
+            add_course_sessions(db, new_course.id, len(schedules_to_add))
             db.commit()
+            schedule_cache.invalidate()
 
         return new_course
     except Exception as e:
@@ -1,22 +1,39 @@
-from sqlalchemy import text
+from sqlalchemy import text, and_
 
-from app.models import Profile, Enrollment, Course,Schedule,AttendanceLog
+from app.models import Profile, Enrollment, Course,Schedule,AttendanceLog,AttendanceSummary,CourseAttendanceTotal
 from app.schemas.profile import ProfileCreate
 
 from fastapi import HTTPException, UploadFile
-from sqlalchemy.dialects.postgresql import insert
 import pandas as pd
+import numpy as np
 import io
+import os
+import asyncio
+import codecs
+import hashlib
+import tempfile
 import httpx
 import re
 import joblib
+import openpyxl
 from sqlmodel import Session, select, func, col
+from sqlmodel.ext.asyncio.session import AsyncSession
 import math
 
 from pathlib import Path
-import traceback
+from typing import Iterator
 
 from app.core.config import HF_OCR_API_URL
+from app.core.db import engine
+from app.core.face_index import face_index
+from app.core.ingest_jobs import (
+    IngestJob,
+    ingest_queue,
+    INGEST_CHUNK_ROWS,
+    INGEST_SPOOL_DIR,
+    INGEST_UPLOAD_BLOCK_BYTES,
+)
+from app.crud.attendance_summary import held_sessions, attendance_counts
 from app.schemas.enrollment import EnrollmentSearchFilter
 
 CURRENT_DIR = Path(__file__).resolve().parent
@@ -57,94 +74,93 @@ def extract_cell_features(cell_value):
 
     return [length, word_count, has_digit, starts_with_B_digit, is_title, is_upper, alpha_ratio]
 
-async def get_student_data_from_file(file: UploadFile):
-    """
-    Đọc file Excel/CSV, sử dụng AI để quét từng hàng (Row Scanning),
-    tìm bộ đôi (ID + Tên) hợp lệ bất kể vị trí cột.
-    """
-    try:
-        contents = await file.read()
-        student_id_pattern = re.compile(r'^B\d{2}[A-Z]{2,6}\d{3}$', re.IGNORECASE)
-
-        df = None
-        if file.filename.endswith('.xlsx') or file.filename.endswith('.xls'):
-            df = pd.read_excel(io.BytesIO(contents), header=None)
-        else:
-            try:
-                df = pd.read_csv(io.BytesIO(contents), header=None, encoding='utf-8')
-            except UnicodeDecodeError:
-                df = pd.read_csv(io.BytesIO(contents), header=None, encoding='tcvn-3')
-
-        if not ai_model:
-            raise HTTPException(status_code=500, detail="AI Model chưa được load. Không thể xử lý file.")
-
-        student_data = []
-
-        for index, row in df.iterrows():
-            found_id = None
-            found_fullname = None
-            found_surname = None
-            found_firstname = None
-
-            for col_idx, cell_val in enumerate(row[:20]):
-                val_str = str(cell_val).strip()
-
-                if len(val_str) < 2 or val_str.lower() == 'nan':
-                    continue
-
-                features = extract_cell_features(val_str)
-                prediction = ai_model.predict([features])[0]
+# Python không có codec tcvn-3; cp1258 là bảng mã tiếng Việt của Windows
+CSV_FALLBACK_ENCODING = 'cp1258'
+ROSTER_FILE_TYPES = ('csv', 'sheet', 'excel')
 
-                if prediction == 1:
-                    if student_id_pattern.match(val_str):
-                        found_id = val_str.upper()
-
-                elif prediction == 2 and not found_fullname:
-                    if not any(char.isdigit() for char in val_str):
-                        found_fullname = val_str
-
-                elif prediction == 3 and not found_surname:
-                    if not any(char.isdigit() for char in val_str):
-                        found_surname = val_str
-
-                elif prediction == 4 and not found_firstname:
-                    if not any(char.isdigit() for char in val_str):
-                        found_firstname = val_str
-
-            if found_id:
-                final_name = ""
-
-                if found_fullname:
-                    final_name = found_fullname
-                elif found_surname and found_firstname:
-                    final_name = f"{found_surname} {found_firstname}"
-
-                if final_name:
-                    final_name = " ".join(final_name.split()).title()
-
-                    student_data.append({
-                        "id": found_id,
-                        "name": final_name
-                    })
-
-        if not student_data:
-            raise HTTPException(status_code=400, detail="Không tìm thấy dữ liệu sinh viên hợp lệ nào trong file.")
-
-        return student_data
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        traceback.print_exc()
-        raise HTTPException(status_code=400, detail=f"Lỗi xử lý file: {str(e)}")
+STUDENT_ID_PATTERN = r'^B\d{2}[A-Z]{2,6}\d{3}$'
+# chỉ quét 20 cột đầu của mỗi hàng
+MAX_SCAN_COLUMNS = 20
 
-async def get_student_ids_from_image(file: UploadFile):
+def cell_feature_matrix(values: pd.Series) -> np.ndarray:
+    """
+    extract_cell_features cho cả một cột giá trị (đã strip), tính bằng các phép
+    xử lý chuỗi của pandas thay vì từng ô một.
+    """
+    values = values.astype(object)
+    length = values.str.len().to_numpy(dtype=np.float64)
+    word_count = values.str.split().str.len().to_numpy(dtype=np.float64)
+    has_digit = values.str.contains(r'\d', regex=True).to_numpy(dtype=np.float64)
+    starts_with_B_digit = values.str.match(r'B\d', case=False).to_numpy(dtype=np.float64)
+    is_title = values.str.istitle().to_numpy(dtype=np.float64)
+    is_upper = values.str.isupper().to_numpy(dtype=np.float64)
+    # str.isalpha theo từng ký tự, khớp đúng với extract_cell_features
+    alpha_count = values.map(lambda v: sum(c.isalpha() for c in v)).to_numpy(dtype=np.float64)
+    alpha_ratio = np.divide(alpha_count, length, out=np.zeros_like(length), where=length > 0)
+
+    return np.column_stack([length, word_count, has_digit, starts_with_B_digit, is_title, is_upper, alpha_ratio])
+
+def predict_cell_labels(values: pd.Series) -> np.ndarray:
+    """
+    Nhãn của model cho từng giá trị; mỗi chuỗi khác nhau chỉ tính một lần,
+    model chỉ được gọi một lần cho cả file.
+    """
+    codes, uniques = pd.factorize(values)
+    features = cell_feature_matrix(pd.Series(uniques, dtype=object))
+    feature_names = getattr(ai_model, "feature_names_in_", None)
+    if feature_names is not None:
+        features = pd.DataFrame(features, columns=feature_names)
+    return np.asarray(ai_model.predict(features))[codes]
+
+def resolve_students(df: pd.DataFrame) -> list:
+    """
+    Tìm bộ đôi (MSSV + Tên) trên từng hàng, cùng quy tắc với việc quét từng ô:
+    MSSV là ô nhãn 1 cuối cùng khớp định dạng; họ tên / họ / tên là ô nhãn
+    2 / 3 / 4 đầu tiên không chứa chữ số.
+    """
+    block = df.iloc[:, :MAX_SCAN_COLUMNS]
+    if block.empty:
+        return []
+    # str() từng ô như khi duyệt iterrows (vd. 1.0 -> "1.0", NaN -> "nan")
+    cells = block.map(str).stack()
+    cells = cells.str.strip()
+    cells = cells[(cells.str.len() >= 2) & (cells.str.lower() != 'nan')]
+    if cells.empty:
+        return []
+
+    labels = predict_cell_labels(cells)
+    rows = cells.index.get_level_values(0)
+    no_digit = ~cells.map(lambda v: any(char.isdigit() for char in v)).to_numpy(dtype=bool)
+    is_id = (labels == 1) & cells.str.match(STUDENT_ID_PATTERN, case=False).to_numpy(dtype=bool)
+
+    row_index = pd.unique(rows)
+
+    def pick(mask: np.ndarray, keep: str) -> pd.Series:
+        # one cell per row (the first / last matching one), NaN for rows without
+        chosen = cells[mask]
+        chosen = chosen[~chosen.index.get_level_values(0).duplicated(keep=keep)].droplevel(1)
+        return chosen.reindex(row_index).astype(object)
+
+    found = pd.DataFrame({
+        "id": pick(is_id, "last").str.upper(),
+        "fullname": pick((labels == 2) & no_digit, "first"),
+        "surname": pick((labels == 3) & no_digit, "first"),
+        "firstname": pick((labels == 4) & no_digit, "first"),
+    })
+
+    found = found[found["id"].notna()]
+    name = found["fullname"].fillna(found["surname"] + " " + found["firstname"])
+    found = found.assign(name=name.str.split().str.join(" ").str.title())
+    found = found[found["name"].notna()]
+
+    return [{"id": row.id, "name": row.name} for row in found.itertuples(index=False)]
+
+async def ocr_student_ids(filename: str, contents: bytes, content_type: str):
 
     if not HF_OCR_API_URL:
         return ["B22DCPT090", "B21DCAT007"]
     try:
-        contents = await file.read()
-        files = {'image': (file.filename, contents, file.content_type)}
+        files = {'image': (filename, contents, content_type)}
         async with httpx.AsyncClient(timeout=60.0) as client:
             response = await client.post(HF_OCR_API_URL, files=files)
             response.raise_for_status()
@@ -155,78 +171,180 @@ async def get_student_ids_from_image(file: UploadFile):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calling OCR: {e}")
 
-async def enroll_students_from_file(db: Session, course_id: int, file: UploadFile):
+UPSERT_STUDENTS_SQL = text("""
+    WITH src AS (
+        SELECT *
+        FROM unnest(CAST(:student_ids AS text[]), CAST(:names AS text[])) AS t(student_id, name)
+        ORDER BY student_id
+    ),
+    up AS (
+        INSERT INTO profiles (student_id, name, role)
+        SELECT student_id, name, 'student' FROM src
+        ON CONFLICT (student_id) DO UPDATE
+            -- giữ tên đã có, chỉ điền tên cho profile tạo từ OCR (tên rỗng)
+            SET name = CASE WHEN profiles.name = '' THEN EXCLUDED.name ELSE profiles.name END
+        RETURNING id, (xmax = 0) AS inserted
+    ),
+    enr AS (
+        INSERT INTO enrollments (profile_id, course_id)
+        SELECT id, :course_id FROM up
+        ON CONFLICT (profile_id, course_id) DO NOTHING
+    )
+    SELECT count(*) AS enrolled, count(*) FILTER (WHERE inserted) AS created
+    FROM up
+""")
 
-    student_data = []
-    file_type = file.content_type
+def upsert_students(db: Session, course_id: int, student_data: list) -> tuple:
+    """
+    Tạo profile cho MSSV chưa có và ghi danh tất cả vào môn học trong một câu
+    lệnh. Trả về (số sinh viên ghi danh, số profile mới).
+    """
+    # mỗi MSSV một lần (ON CONFLICT không cho cập nhật một hàng hai lần), tên
+    # xuất hiện sau cùng được giữ; sắp xếp để các lần upload song song khóa
+    # các hàng profiles theo cùng thứ tự
+    names_by_id = {item['id']: item['name'] for item in student_data}
+    if not names_by_id:
+        raise HTTPException(status_code=400, detail="Không có sinh viên hợp lệ để ghi danh.")
+    student_ids = sorted(names_by_id)
 
-    await file.seek(0)
+    try:
+        row = db.execute(UPSERT_STUDENTS_SQL, {
+            "student_ids": student_ids,
+            "names": [names_by_id[sid] for sid in student_ids],
+            "course_id": course_id,
+        }).one()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Lỗi ghi danh: {e}")
 
-    if 'image' in file_type:
-        ocr_ids = await get_student_ids_from_image(file)
-        student_data = [{"id": sid, "name": ""} for sid in ocr_ids]
+    return row.enrolled, row.created
 
-    elif 'csv' in file_type or 'sheet' in file_type or 'excel' in file_type:
-        student_data = await get_student_data_from_file(file)
+def detect_csv_encoding(path: str) -> str:
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(INGEST_UPLOAD_BLOCK_BYTES), b''):
+                decoder.decode(block)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return CSV_FALLBACK_ENCODING
+    return 'utf-8'
+
+def read_roster_chunks(path: str, filename: str, chunk_rows: int = INGEST_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Đọc file danh sách theo từng khối chunk_rows hàng thay vì cả file một lúc.
+    """
+    filename = filename.lower()
+    if filename.endswith('.xlsx'):
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = []
+            for values in workbook.worksheets[0].iter_rows(values_only=True):
+                # ô trống là NaN, giống pd.read_excel
+                rows.append([np.nan if v is None else v for v in values])
+                if len(rows) == chunk_rows:
+                    yield pd.DataFrame(rows)
+                    rows = []
+            if rows:
+                yield pd.DataFrame(rows)
+        finally:
+            workbook.close()
+
+    elif filename.endswith('.xls'):
+        # openpyxl không đọc được .xls; định dạng cũ tối đa 65536 hàng
+        df = pd.read_excel(path, header=None)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
 
     else:
-        raise HTTPException(status_code=400, detail="Chỉ hỗ trợ file .csv, .xls, .xlsx và ảnh (.png, .jpg)")
+        yield from pd.read_csv(path, header=None, encoding=detect_csv_encoding(path), chunksize=chunk_rows)
 
-    if not student_data:
-        raise HTTPException(status_code=404, detail="Không tìm thấy MSSV nào.")
+async def spool_upload(file: UploadFile) -> tuple:
+    """
+    Ghi file upload xuống đĩa theo từng khối; trả về (đường dẫn file tạm, SHA-256).
+    """
+    suffix = Path(file.filename or '').suffix
+    fd, path = tempfile.mkstemp(prefix="enroll_", suffix=suffix, dir=INGEST_SPOOL_DIR)
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while block := await file.read(INGEST_UPLOAD_BLOCK_BYTES):
+                digest.update(block)
+                out.write(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
 
-    all_ids_in_file = list(set(item['id'] for item in student_data))
-    data_map_by_id = {item['id']: item for item in student_data}
+def ingest_roster_file(job: IngestJob):
+    """
+    Phân loại và ghi danh từng khối của file; tiến độ được lưu vào hàng đợi
+    sau mỗi khối. Chạy trong thread riêng với session đồng bộ.
+    """
+    with Session(engine) as db:
+        for chunk in read_roster_chunks(job.path, job.filename):
+            job.chunks += 1
+            job.rows_read += len(chunk)
 
-    statement = select(Profile).where(Profile.student_id.in_(all_ids_in_file))
-    found_profiles = db.exec(statement).all()
-    found_ids = set(p.student_id for p in found_profiles)
+            student_data = resolve_students(chunk)
+            if student_data:
+                enrolled, created = upsert_students(db, job.course_id, student_data)
+                job.students_found += len(student_data)
+                job.enrolled += enrolled
+                job.profiles_created += created
+                face_index.invalidate_course(job.course_id)
 
-    new_ids_to_create = set(all_ids_in_file) - found_ids
-    new_profiles = []
+            ingest_queue.checkpoint(job)
 
-    for new_id in new_ids_to_create:
-        student_name = data_map_by_id[new_id]['name']
-        new_profile = Profile(student_id=new_id, name=student_name)
-        db.add(new_profile)
-        new_profiles.append(new_profile)
+    if not job.students_found:
+        raise HTTPException(status_code=400, detail="Không tìm thấy dữ liệu sinh viên hợp lệ nào trong file.")
 
-    if new_profiles:
-        try:
-            db.commit()
-            for p in new_profiles:
-                db.refresh(p)
-        except Exception as e:
-            db.rollback()
-            raise HTTPException(status_code=500, detail=f"Lỗi tạo profile mới: {e}")
-
-    final_profile_id_map = {p.student_id: p.id for p in found_profiles}
-    final_profile_id_map.update({p.student_id: p.id for p in new_profiles})
-
-    enrollment_dicts = []
-    for sid in all_ids_in_file:
-        pid = final_profile_id_map.get(sid)
-        if pid:
-            enrollment_dicts.append({'profile_id': pid, 'course_id': course_id})
-
-    if not enrollment_dicts:
-        raise HTTPException(status_code=400, detail="Không có sinh viên hợp lệ để ghi danh.")
+def enroll_student_ids(job: IngestJob, student_ids: list):
 
-    try:
-        stmt = insert(Enrollment).values(enrollment_dicts).on_conflict_do_nothing(
-            index_elements=['profile_id', 'course_id']
-        )
-        db.execute(stmt)
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Lỗi ghi danh: {e}")
+    with Session(engine) as db:
+        enrolled, created = upsert_students(db, job.course_id, [{"id": sid, "name": ""} for sid in student_ids])
+    job.enrolled = enrolled
+    job.profiles_created = created
+    face_index.invalidate_course(job.course_id)
+
+async def run_roster_job(job: IngestJob):
+    await asyncio.to_thread(ingest_roster_file, job)
 
-    message = f"Ghi danh thành công {len(enrollment_dicts)} sinh viên."
-    if new_profiles:
-        message += f" Đã tạo {len(new_profiles)} profile mới."
+async def run_ocr_job(job: IngestJob):
 
-    return {"success": True, "message": message}
+    contents = await asyncio.to_thread(Path(job.path).read_bytes)
+    student_ids = await ocr_student_ids(job.filename, contents, job.content_type)
+    job.students_found = len(student_ids)
+    if not student_ids:
+        raise HTTPException(status_code=404, detail="Không tìm thấy MSSV nào.")
+    await asyncio.to_thread(enroll_student_ids, job, student_ids)
+
+INGEST_HANDLERS = {
+    "roster": run_roster_job,
+    "ocr": run_ocr_job,
+}
+
+async def start_enrollment_ingest(course_id: int, file: UploadFile) -> tuple:
+    """
+    Đưa file vào hàng đợi xử lý nền; trả về (job, created). Gửi lại cùng một
+    file cho cùng môn học trả về job cũ, trừ khi job đó đã thất bại.
+    """
+    file_type = file.content_type or ''
+    if 'image' in file_type:
+        kind = "ocr"
+    elif any(t in file_type for t in ROSTER_FILE_TYPES):
+        kind = "roster"
+        if not ai_model:
+            raise HTTPException(status_code=500, detail="AI Model chưa được load. Không thể xử lý file.")
+    else:
+        raise HTTPException(status_code=400, detail="Chỉ hỗ trợ file .csv, .xls, .xlsx và ảnh (.png, .jpg)")
+
+    path, file_hash = await spool_upload(file)
+    job, created = await ingest_queue.submit(kind, course_id, file.filename, file_type, path, file_hash)
+    if not created:
+        os.remove(path)
+    return job, created
 
 async def get_enrollments_by_course(db: Session, course_id: int):
 
@@ -250,7 +368,7 @@ async def get_enrollments_by_course(db: Session, course_id: int):
 
     return enrollment_list
 
-def search_enrollments(db: Session, filter: EnrollmentSearchFilter):
+async def search_enrollments(db: AsyncSession, filter: EnrollmentSearchFilter):
     statement = (
         select(Enrollment, Profile)
         .join(Profile, Enrollment.profile_id == Profile.id)
@@ -266,49 +384,28 @@ def search_enrollments(db: Session, filter: EnrollmentSearchFilter):
         statement = statement.where(Profile.name.ilike(f"%{filter.student_name}%"))
 
     total_count_stmt = select(func.count()).select_from(statement.subquery())
-    total_rows = db.exec(total_count_stmt).one()
+    total_rows = (await db.exec(total_count_stmt)).one()
+
+    # thống kê đọc từ attendance_summaries: một hàng cho mỗi sinh viên trong trang;
+    # vắng mặt chỉ tính trên các buổi đã bắt đầu
+    held = held_sessions(filter.course_id or None)
+    statement = (
+        statement
+        .add_columns(AttendanceSummary.attended, AttendanceSummary.late, CourseAttendanceTotal.total_sessions, held.c.held)
+        .outerjoin(AttendanceSummary, and_(
+            AttendanceSummary.course_id == Enrollment.course_id,
+            AttendanceSummary.profile_id == Enrollment.profile_id
+        ))
+        .outerjoin(CourseAttendanceTotal, CourseAttendanceTotal.course_id == Enrollment.course_id)
+        .outerjoin(held, held.c.course_id == Enrollment.course_id)
+    )
 
     offset = (filter.page - 1) * filter.page_size
     statement = statement.offset(offset).limit(filter.page_size)
-    results = db.exec(statement).all()
-
-    profile_ids = [p.id for (_, p) in results]
-
-    if filter.course_id:
-
-        schedule_ids = db.exec(
-            select(Schedule.id).where(Schedule.course_id == filter.course_id)
-        ).all()
-
-        schedule_ids = list(schedule_ids)
-    else:
-        schedule_ids = []
-
-    total_sessions = len(schedule_ids)
-
-    attendance_map = {}
-    if total_sessions > 0 and profile_ids:
-        rows = db.exec(
-            select(
-                AttendanceLog.profile_id,
-                func.count().label("cnt")
-            )
-            .where(AttendanceLog.profile_id.in_(profile_ids))
-            .where(AttendanceLog.schedule_id.in_(schedule_ids))
-            .where(AttendanceLog.status.in_(["present", "late"]))
-            .group_by(AttendanceLog.profile_id)
-        ).all()
-
-        attendance_map = {pid: cnt for (pid, cnt) in rows}
+    results = (await db.exec(statement)).all()
 
     data = []
-    for enrollment, profile in results:
-        attended_count = attendance_map.get(profile.id, 0)
-        attendance_rate = (
-            round(attended_count / total_sessions * 100, 1)
-            if total_sessions > 0 else 0.0
-        )
-
+    for enrollment, profile, attended, late, total_sessions, held_count in results:
         data.append({
             "enrollment_id": enrollment.id,
             "course_id": enrollment.course_id,
@@ -316,9 +413,8 @@ def search_enrollments(db: Session, filter: EnrollmentSearchFilter):
             "student_name": profile.name,
             "profile_id": profile.id,
 
-            "attended_count": attended_count,
-            "total_sessions": total_sessions,
-            "attendance_rate": attendance_rate
+            **attendance_counts(attended, late, held_count),
+            "total_sessions": total_sessions or 0,
         })
 
     return {
@@ -352,6 +448,7 @@ def add_student_to_course(db: Session, course_id: int, profile_data: ProfileCrea
         enrollment = Enrollment(course_id=course_id, profile_id=profile.id)
         db.add(enrollment)
         db.commit()
+        face_index.invalidate_course(course_id)
 
     return {
         "message": "Student enrolled successfully",
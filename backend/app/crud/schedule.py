@@ -1,6 +1,7 @@
 
 from fastapi import HTTPException
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from app.models.schedule import Schedule
@@ -8,14 +9,14 @@ from app.models.log import AttendanceLog
 from app.models.course import Course
 from app.models.enrollment import Enrollment
 
-def get_session_data(db: Session, schedule_id: int):
+async def get_session_data(db: AsyncSession, schedule_id: int):
 
     statement = select(Schedule).where(Schedule.id == schedule_id).options(
         selectinload(Schedule.attendance_logs).selectinload(AttendanceLog.profile),
         selectinload(Schedule.course).selectinload(Course.enrollments).selectinload(Enrollment.profile)
     )
 
-    schedule = db.exec(statement).first()
+    schedule = (await db.exec(statement)).first()
 
     if not schedule:
         raise HTTPException(status_code=404, detail="Không tìm thấy buổi học")
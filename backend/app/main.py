@@ -1,9 +1,17 @@
+import asyncio
+
 from fastapi import FastAPI
+from sqlmodel import Session
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api import face_embedding, log,course,lecturer,enrollment,schedule
 
-from app.core.db import create_db_and_tables
+from app.core.db import create_db_and_tables, engine, async_engine
+from app.core.face_client import face_client
+from app.core.ingest_jobs import ingest_queue
+from app.crud.enrollment import INGEST_HANDLERS
+from app.core.schedule_cache import schedule_cache, SCHEDULE_CACHE_ENABLED, SCHEDULE_CACHE_REFRESH_SECONDS
+from app.core.face_index import face_index, FACE_INDEX_ENABLED, FACE_INDEX_REFRESH_SECONDS
 app = FastAPI(title="FaceID Attendance API")
 
 origins = [
@@ -18,9 +26,60 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+def load_face_index():
+    try:
+        with Session(engine) as session:
+            face_index.load(session)
+    except Exception as e:
+        print(f"--- Warning: Failed to load face index, falling back to match_users: {e} ---")
+
+async def refresh_face_index_periodically():
+    # picks up enrollments made through other workers / replicas
+    while True:
+        await asyncio.sleep(FACE_INDEX_REFRESH_SECONDS)
+        await asyncio.to_thread(load_face_index)
+
+def load_schedule_cache():
+    try:
+        with Session(engine) as session:
+            schedule_cache.load(session)
+    except Exception as e:
+        print(f"--- Warning: Failed to refresh schedule cache: {e} ---")
+
+async def refresh_schedule_cache_periodically():
+    # reload ahead of expiry so check-ins don't pay for it
+    while True:
+        await asyncio.to_thread(load_schedule_cache)
+        await asyncio.sleep(max(SCHEDULE_CACHE_REFRESH_SECONDS - 5, 1))
+
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     create_db_and_tables()
+    face_client.start()
+    ingest_queue.start(INGEST_HANDLERS)
+    if SCHEDULE_CACHE_ENABLED:
+        asyncio.create_task(refresh_schedule_cache_periodically())
+    if FACE_INDEX_ENABLED:
+        try:
+            restored = await asyncio.to_thread(face_index.restore)
+        except Exception as e:
+            print(f"--- Warning: Failed to restore saved face index, loading from the database: {e} ---")
+            restored = False
+        if restored:
+            # serve from the saved index; the database reload only applies the differences
+            asyncio.create_task(asyncio.to_thread(load_face_index))
+        else:
+            await asyncio.to_thread(load_face_index)
+        if FACE_INDEX_REFRESH_SECONDS > 0:
+            asyncio.create_task(refresh_face_index_periodically())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await ingest_queue.stop()
+    await face_client.close()
+    await async_engine.dispose()
+    if FACE_INDEX_ENABLED and face_index.ready:
+        await asyncio.to_thread(face_index.save)
 app.include_router(log.router)
 app.include_router(face_embedding.router)
 app.include_router(course.router)
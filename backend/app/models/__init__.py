@@ -5,6 +5,7 @@ from .schedule import Schedule
 from .enrollment import Enrollment
 from .face_embedding import FaceEmbedding
 from .log import AttendanceLog
+from .attendance_summary import AttendanceSummary, CourseAttendanceTotal
 
 __all__ = [
     "Course",
@@ -14,4 +15,6 @@ __all__ = [
     "Enrollment",
     "FaceEmbedding",
     "AttendanceLog",
+    "AttendanceSummary",
+    "CourseAttendanceTotal",
 ]
\ No newline at end of file
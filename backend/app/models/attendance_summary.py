@@ -0,0 +1,14 @@
+from sqlmodel import SQLModel, Field
+
+class AttendanceSummary(SQLModel, table=True):
+    __tablename__ = 'attendance_summaries'
+    # maintained by check-in; rebuilt from attendance_logs by app.crud.attendance_summary
+    course_id: int = Field(foreign_key="courses.id", primary_key=True)
+    profile_id: int = Field(foreign_key="profiles.id", primary_key=True)
+    attended: int = Field(default=0)  # present + late
+    late: int = Field(default=0)
+
+class CourseAttendanceTotal(SQLModel, table=True):
+    __tablename__ = 'course_attendance_totals'
+    course_id: int = Field(foreign_key="courses.id", primary_key=True)
+    total_sessions: int = Field(default=0)
@@ -15,6 +15,8 @@ class Course(SQLModel, table=True):
     template_end_time: Optional[datetime] = None
     number_of_sessions: Optional[int] = None
     template_room: Optional[str] = None
+    # minutes after start_time a check-in still counts as present; None: LATE_THRESHOLD_MINUTES
+    late_threshold_minutes: Optional[int] = None
 
     schedules: List["Schedule"] = Relationship(back_populates="course")
     enrollments: List["Enrollment"] = Relationship(back_populates="course")
\ No newline at end of file
@@ -5,5 +5,6 @@ class FaceEmbedding(SQLModel, table=True):
     __tablename__ = 'face_embeddings'
     id: Optional[int] = Field(default=None, primary_key=True)
 
-    profile_id: int = Field(foreign_key="profiles.id", unique=True)
-    profile: "Profile" = Relationship(back_populates="face_embedding")
\ No newline at end of file
+    # several templates per student (angles, lighting), see TEMPLATE_AGGREGATION
+    profile_id: int = Field(foreign_key="profiles.id", index=True)
+    profile: "Profile" = Relationship(back_populates="face_embeddings")
\ No newline at end of file
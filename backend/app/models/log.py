@@ -1,9 +1,11 @@
-from sqlmodel import SQLModel, Field, Relationship, text, Column, DateTime
+from sqlmodel import SQLModel, Field, Relationship, text, Column, DateTime, UniqueConstraint
 from typing import Optional
 from datetime import datetime
 
 class AttendanceLog(SQLModel, table=True):
     __tablename__ = 'attendance_logs'
+    # one check-in per student per session; check-in relies on it for ON CONFLICT
+    __table_args__ = (UniqueConstraint("schedule_id", "profile_id", name="ux_attendance_logs_schedule_profile"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     status: str
     check_in_time: Optional[datetime] = Field(
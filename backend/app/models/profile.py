@@ -10,7 +10,7 @@ class Profile(SQLModel, table=True):
     role: str = Field(default='student')
 
     lecturer: Optional["Lecturer"] = Relationship(back_populates="profile")
-    face_embedding: Optional["FaceEmbedding"] = Relationship(back_populates="profile")
+    face_embeddings: List["FaceEmbedding"] = Relationship(back_populates="profile")
     enrollments: List["Enrollment"] = Relationship(back_populates="profile")
     attendance_logs: List["AttendanceLog"] = Relationship(back_populates="profile")
 
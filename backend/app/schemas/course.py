@@ -19,6 +19,7 @@ class CourseCreateRequest(BaseModel):
     template_end_time: datetime
     number_of_sessions: int
     template_room: Optional[str] = None
+    late_threshold_minutes: Optional[int] = None
 
 class ScheduleSimple(BaseModel):
     id: int
@@ -1,9 +1,32 @@
 from pydantic import BaseModel
+from typing import List, Optional
 from app.schemas.profile import ProfilePublic
 class EnrollRequest(BaseModel):
     studentId: str
     name: str
     image_base64: str
+    # True: drop the student's previous face templates instead of adding to them
+    replace: bool = False
+
+class BulkEnrollStudent(BaseModel):
+    studentId: str
+    name: str
+    images_base64: List[str]
+
+class BulkEnrollRequest(BaseModel):
+    students: List[BulkEnrollStudent]
+    replace: bool = False
+
+class BulkEnrollResult(BaseModel):
+    studentId: str
+    profile_id: Optional[int] = None
+    templates: int = 0
+    failed_images: List[int] = []
+
+class BulkEnrollResponse(BaseModel):
+    success: bool = True
+    enrolled: int
+    results: List[BulkEnrollResult] = []
 
 class SearchRequest(BaseModel):
     course_id: int
@@ -16,4 +39,23 @@ class EnrollResponse(BaseModel):
 class SearchResponse(BaseModel):
     success: bool = True
     name: str
-    student_id: str
\ No newline at end of file
+    student_id: str
+
+class MultiSearchRequest(BaseModel):
+    course_id: int
+    image_base64: str
+
+class FaceCheckInResult(BaseModel):
+    box: List[float]
+    probability: float
+    status: str
+    profile_id: Optional[int] = None
+    name: Optional[str] = None
+    student_id: Optional[str] = None
+
+class MultiSearchResponse(BaseModel):
+    success: bool = True
+    schedule_id: int
+    total_faces: int
+    checked_in: int
+    results: List[FaceCheckInResult] = []
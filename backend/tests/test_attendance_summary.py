@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlmodel import Session, select
+
+from app.crud.attendance_summary import attendance_counts, held_sessions
+from app.models import Schedule
+
+NOW = datetime(2026, 3, 2, 8, 0, tzinfo=timezone.utc)
+
+def _session_with_schedules(*starts: datetime) -> Session:
+    engine = create_engine("sqlite://")
+    Schedule.__table__.create(engine)
+    session = Session(engine)
+    for start in starts:
+        session.add(Schedule(course_id=1, start_time=start, end_time=start + timedelta(hours=2)))
+    session.commit()
+    return session
+
+def test_future_schedules_are_not_held():
+    session = _session_with_schedules(
+        NOW - timedelta(days=14),
+        NOW - timedelta(days=7),
+        NOW,
+        NOW + timedelta(days=7),
+        NOW + timedelta(days=14),
+    )
+    held = held_sessions(now=NOW)
+
+    rows = session.exec(select(held.c.course_id, held.c.held)).all()
+
+    assert rows == [(1, 3)]
+
+def test_absences_count_only_held_sessions():
+    session = _session_with_schedules(NOW - timedelta(days=7), NOW + timedelta(days=7), NOW + timedelta(days=14))
+    held = session.exec(select(held_sessions(now=NOW).c.held)).one()
+
+    counts = attendance_counts(1, 0, held)
+
+    assert counts["absent_count"] == 0
+    assert counts["attendance_rate"] == 100.0
+
+def test_counts_before_any_session():
+    counts = attendance_counts(None, None, None)
+
+    assert counts["absent_count"] == 0
+    assert counts["held_sessions"] == 0
+    assert counts["attendance_rate"] == 0.0
+
+def test_held_sessions_binds_naive_utc_for_asyncpg():
+    dialect = postgresql.asyncpg.dialect()
+    compiled = select(held_sessions(now=NOW).c.held).compile(dialect=dialect)
+
+    values = []
+    for bind in compiled.binds.values():
+        process = bind.type.dialect_impl(dialect).bind_processor(dialect)
+        values.append(process(bind.value) if process else bind.value)
+
+    assert values
+    assert all(value == NOW.replace(tzinfo=None) and value.tzinfo is None for value in values)
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.core.vector_engine import IVFEngine, atomic_write, save_npz
+
+DIM = 16
+
+def _vectors(n: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def test_save_npz_keeps_the_given_name(tmp_path):
+    path = str(tmp_path / "face_index")
+    save_npz(path, a=np.arange(3))
+
+    assert os.listdir(tmp_path) == ["face_index"]
+    with np.load(path) as data:
+        assert data["a"].tolist() == [0, 1, 2]
+
+def test_ivf_save_then_load_restores_the_index(tmp_path):
+    vectors = _vectors(300)
+    ids = np.arange(300, dtype=np.int64) * 5
+    engine = IVFEngine(DIM, nlist=8, nprobe=8)
+    engine.build(vectors, ids)
+    engine.remove([0])
+    engine.add([5], vectors[:1])
+
+    path = str(tmp_path / "face_index.ivf")
+    engine.save(path)
+    assert os.path.exists(path)
+
+    loaded = IVFEngine(DIM, nlist=8, nprobe=8)
+    assert loaded.load(path)
+    assert len(loaded) == len(engine)
+
+    queries = _vectors(20, seed=1)
+    labels, distances = engine.search(queries, 3)
+    loaded_labels, loaded_distances = loaded.search(queries, 3)
+    assert np.array_equal(labels, loaded_labels)
+    assert np.allclose(distances, loaded_distances)
+
+def test_ivf_load_of_missing_file_is_false(tmp_path):
+    assert not IVFEngine(DIM).load(str(tmp_path / "missing.ivf"))
+
+def test_failed_write_keeps_the_previous_file(tmp_path):
+    path = str(tmp_path / "index")
+    save_npz(path, a=np.arange(3))
+
+    def broken(tmp: str):
+        with open(tmp, "wb") as f:
+            f.write(b"partial")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        atomic_write(path, broken)
+
+    assert os.listdir(tmp_path) == ["index"]
+    with np.load(path) as data:
+        assert data["a"].tolist() == [0, 1, 2]
@@ -0,0 +1,146 @@
+"""
+Micro-batching of concurrent embedding requests.
+"""
+import asyncio
+import os
+from typing import List, Optional, Set
+
+import numpy as np
+
+from face_ulti import images_to_embeddings
+from inference_executor import InferenceExecutor
+
+BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "10"))
+MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH", "32"))
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+class EmbeddingBatcher:
+
+    def __init__(
+        self,
+        executor: InferenceExecutor,
+        window_ms: float = BATCH_WINDOW_MS,
+        max_batch: int = MAX_BATCH_SIZE,
+    ):
+        self.executor = executor
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+
+        self._batch_size_counts = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self._batch_size_overflow = 0
+        self._batches = 0
+        self._items = 0
+        self._max_queue_depth = 0
+
+    def start(self):
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        for task in self._in_flight:
+            task.cancel()
+        await asyncio.gather(self._worker, *self._in_flight, return_exceptions=True)
+        self._worker = None
+        self._in_flight.clear()
+
+    async def embed(self, image: np.ndarray) -> Optional[List[float]]:
+        if self._worker is None:
+            self.start()
+
+        if self._queue.qsize() >= self.executor.max_pending:
+            self.executor.reject()
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, future))
+        self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def _collect_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window
+
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        # one batch in flight per executor worker; while they are all busy,
+        # new requests keep queueing and go out together in the next batch
+        slots = asyncio.Semaphore(self.executor.workers)
+        while True:
+            await slots.acquire()
+            try:
+                batch = await self._collect_batch()
+            except BaseException:
+                slots.release()
+                raise
+            self._record_batch(len(batch))
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def _dispatch(self, batch: list):
+        images = [image for image, _ in batch]
+        try:
+            # requests already admitted to the queue are never rejected
+            embeddings = await self.executor.run(
+                images_to_embeddings, images, bounded=False
+            )
+        except Exception as e:
+            print(f"Error in batched embedding: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    def _record_batch(self, size: int):
+        self._batches += 1
+        self._items += size
+        for bucket in BATCH_SIZE_BUCKETS:
+            if size <= bucket:
+                self._batch_size_counts[bucket] += 1
+                return
+        self._batch_size_overflow += 1
+
+    def stats(self) -> dict:
+        histogram = {f"le_{bucket}": count for bucket, count in self._batch_size_counts.items()}
+        histogram["le_inf"] = self._batch_size_overflow
+
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+            "in_flight": len(self._in_flight),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self._max_queue_depth,
+            "batches": self._batches,
+            "items": self._items,
+            "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+            "batch_size_histogram": histogram,
+        }
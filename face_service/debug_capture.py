@@ -0,0 +1,141 @@
+"""
+Sampled, asynchronous capture of detected face crops for debugging.
+
+Off by default. When enabled, a sampled subset of crops is handed to a
+background thread which JPEG-encodes them into a size-bounded directory,
+evicting the oldest captures first. The request path only enqueues.
+"""
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Optional
+
+import cv2
+import numpy as np
+
+DEBUG_CAPTURE_ENABLED = os.getenv("DEBUG_CAPTURE_ENABLED", "false").lower() in ("1", "true", "yes")
+DEBUG_CAPTURE_DIR = os.getenv("DEBUG_CAPTURE_DIR", "tmp_images")
+DEBUG_CAPTURE_SAMPLE_RATE = float(os.getenv("DEBUG_CAPTURE_SAMPLE_RATE", "0.01"))
+DEBUG_CAPTURE_MAX_BYTES = int(os.getenv("DEBUG_CAPTURE_MAX_MB", "100")) * 1024 * 1024
+DEBUG_CAPTURE_QUEUE_SIZE = int(os.getenv("DEBUG_CAPTURE_QUEUE_SIZE", "64"))
+
+class DebugCapture:
+
+    def __init__(
+        self,
+        enabled: bool = DEBUG_CAPTURE_ENABLED,
+        directory: str = DEBUG_CAPTURE_DIR,
+        sample_rate: float = DEBUG_CAPTURE_SAMPLE_RATE,
+        max_bytes: int = DEBUG_CAPTURE_MAX_BYTES,
+        queue_size: int = DEBUG_CAPTURE_QUEUE_SIZE,
+    ):
+        self.enabled = enabled and sample_rate > 0
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._files: deque = deque()
+        self._total_bytes = 0
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+        self.captured = 0
+        self.dropped = 0
+
+    def maybe_capture(self, face):
+        """
+        face: RGB crop, either an HxWx3 array or an MTCNN 3xHxW tensor.
+        Conversion and encoding happen on the capture thread.
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            return
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(face)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="debug-capture", daemon=True)
+            self._thread.start()
+
+    def _load_existing(self):
+        # pick up captures left by a previous run so the size bound holds across restarts
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".jpg"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+
+        for _, path, size in sorted(entries):
+            self._files.append((path, size))
+            self._total_bytes += size
+
+    def _run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_existing()
+
+        while True:
+            face = self._queue.get()
+            try:
+                self._write(face)
+            except Exception as e:
+                print(f"Error writing debug capture: {e}")
+
+    def _write(self, face):
+        if isinstance(face, np.ndarray):
+            face_rgb = face
+        else:
+            face_rgb = face.permute(1, 2, 0).cpu().numpy()
+        if face_rgb.dtype != np.uint8:
+            face_rgb = face_rgb.astype(np.uint8)
+        ok, encoded = cv2.imencode(".jpg", cv2.cvtColor(face_rgb, cv2.COLOR_RGB2BGR))
+        if not ok:
+            return
+
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.jpg"
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(encoded.tobytes())
+
+        self._files.append((path, len(encoded)))
+        self._total_bytes += len(encoded)
+        self.captured += 1
+        self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._files:
+            path, size = self._files.popleft()
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "captured": self.captured,
+            "dropped": self.dropped,
+            "disk_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+debug_capture = DebugCapture()
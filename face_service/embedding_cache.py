@@ -0,0 +1,334 @@
+"""
+Content-addressed cache of embedding / detection results.
+
+Kiosks resend identical frames and the backend retries after timeouts, so the
+result for a given image is cached under a hash of its bytes: an in-memory
+LRU bounded by size and TTL, plus an optional SQLite file that replicas on the
+same host can share. A request for an image that is still being processed
+waits for that result instead of running MTCNN + MobileNet again.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import numpy as np
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "64")) * 1024 * 1024
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "600"))
+# e.g. /dev/shm/face_embedding_cache.sqlite3 to share results between replicas
+EMBEDDING_CACHE_SHARED_PATH = os.getenv("EMBEDDING_CACHE_SHARED_PATH", "")
+
+# bookkeeping per entry (key, OrderedDict node, tuple) on top of the payload
+ENTRY_OVERHEAD_BYTES = 256
+
+def _value_size(value: Any) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, list):
+        return sum(_value_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_value_size(item) for item in value.values()) + ENTRY_OVERHEAD_BYTES
+    return 64
+
+def _encode_shared(value: Any) -> Tuple[str, bytes]:
+    # (JSON metadata, float32 embedding bytes): nothing read back from the
+    # shared file is ever executed, unlike a pickle
+    if value is None:
+        return "null", b""
+    if isinstance(value, np.ndarray):
+        return json.dumps({"kind": "embedding"}), np.asarray(value, dtype=np.float32).tobytes()
+    faces = [{name: item for name, item in detection.items() if name != "embedding"} for detection in value]
+    vectors = b"".join(np.asarray(detection["embedding"], dtype=np.float32).tobytes() for detection in value)
+    return json.dumps({"kind": "faces", "faces": faces}), vectors
+
+def _decode_shared(meta: str, vectors: bytes) -> Any:
+    meta = json.loads(meta)
+    if meta is None:
+        return None
+    embeddings = np.frombuffer(vectors, dtype=np.float32)
+    if meta["kind"] == "embedding":
+        return embeddings
+    faces = meta["faces"]
+    if not faces:
+        return []
+    return [
+        {**face, "embedding": embedding}
+        for face, embedding in zip(faces, embeddings.reshape(len(faces), -1))
+    ]
+
+class SharedStore:
+    """
+    SQLite key/value file with expiry; blocking, so called via asyncio.to_thread.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_results "
+                "(key TEXT PRIMARY KEY, meta TEXT NOT NULL, vectors BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        row = self._conn().execute(
+            "SELECT meta, vectors FROM embedding_results WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return False, None
+        return True, _decode_shared(row[0], row[1])
+
+    def put(self, key: str, value: Any):
+        meta, vectors = _encode_shared(value)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO embedding_results (key, meta, vectors, expires_at) VALUES (?, ?, ?, ?)",
+                (key, meta, vectors, time.time() + self.ttl),
+            )
+            # opportunistic cleanup keeps the file from growing without bound
+            conn.execute("DELETE FROM embedding_results WHERE expires_at <= ?", (time.time(),))
+
+class EmbeddingCache:
+
+    def __init__(
+        self,
+        enabled: bool = EMBEDDING_CACHE_ENABLED,
+        max_bytes: int = EMBEDDING_CACHE_MAX_BYTES,
+        ttl: float = EMBEDDING_CACHE_TTL_SECONDS,
+        shared_path: str = EMBEDDING_CACHE_SHARED_PATH,
+    ):
+        self.enabled = enabled and max_bytes > 0
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shared = SharedStore(shared_path, ttl) if self.enabled and shared_path else None
+
+        # key -> (expires_at, size, value), oldest first
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.inflight_hits = 0
+        self.shared_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(kind: str, data) -> str:
+        """
+        kind separates result types ("single" embedding vs all "faces") and
+        the model backend, so results never leak across them.
+        """
+        if isinstance(data, str):
+            data = data.encode("ascii", errors="ignore")
+        return f"{kind}:{hashlib.blake2b(data, digest_size=16).hexdigest()}"
+
+    def _get_local(self, key: str) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, size, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._bytes -= size
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _put_local(self, key: str, value: Any):
+        size = _value_size(value) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._bytes += size
+
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    async def get(self, key: str) -> Tuple[bool, Any]:
+        if not self.enabled:
+            return False, None
+
+        found, value = self._get_local(key)
+        if found:
+            self.hits += 1
+            return True, value
+
+        if self.shared is not None:
+            try:
+                found, value = await asyncio.to_thread(self.shared.get, key)
+            except (sqlite3.Error, ValueError, KeyError) as e:
+                print(f"Error reading shared embedding cache: {e}")
+                found = False
+            if found:
+                self.shared_hits += 1
+                self._put_local(key, value)
+                return True, value
+
+        return False, None
+
+    async def put(self, key: str, value: Any):
+        if not self.enabled:
+            return
+        self._put_local(key, value)
+        if self.shared is not None:
+            try:
+                await asyncio.to_thread(self.shared.put, key, value)
+            except sqlite3.Error as e:
+                print(f"Error writing shared embedding cache: {e}")
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Cached result for key, or compute() once; concurrent callers with the
+        same key share the in-flight computation. Exceptions are not cached.
+        """
+        if not self.enabled:
+            return await compute()
+
+        found, value = await self.get(key)
+        if found:
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.inflight_hits += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        # a task of its own, so a caller that disconnects doesn't cancel it for the others
+        task = asyncio.ensure_future(self._compute_and_store(key, compute))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await compute()
+            await self.put(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_compute_many(
+        self, keys: List[str], compute: Callable[[List[int]], Awaitable[List[Any]]]
+    ) -> List[Any]:
+        """
+        Batch get_or_compute. compute(indices) runs once for the positions of
+        the keys that are neither cached nor in flight and returns their values
+        in that order; an Exception in place of a value is not cached. Results
+        come back in key order, with such exceptions in place of values.
+        """
+        if not self.enabled:
+            return await compute(list(range(len(keys))))
+
+        results: List[Any] = [None] * len(keys)
+        pending: Dict[int, asyncio.Future] = {}
+        owned: Dict[str, asyncio.Future] = {}
+        owned_indices: List[int] = []
+        loop = asyncio.get_running_loop()
+
+        try:
+            for idx, key in enumerate(keys):
+                found, value = await self.get(key)
+                if found:
+                    results[idx] = value
+                    continue
+
+                future = self._inflight.get(key)
+                if future is not None:
+                    self.inflight_hits += 1
+                else:
+                    self.misses += 1
+                    future = owned[key] = self._inflight[key] = loop.create_future()
+                    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                    owned_indices.append(idx)
+                pending[idx] = future
+        except BaseException:
+            self._abandon(owned)
+            raise
+
+        if owned:
+            task = asyncio.ensure_future(self._compute_many_and_store(owned, owned_indices, compute))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            await asyncio.shield(task)
+
+        for idx, future in pending.items():
+            try:
+                results[idx] = await asyncio.shield(future)
+            except Exception as e:
+                results[idx] = e
+        return results
+
+    async def _compute_many_and_store(
+        self, owned: Dict[str, asyncio.Future], indices: List[int],
+        compute: Callable[[List[int]], Awaitable[List[Any]]],
+    ):
+        try:
+            values = await compute(indices)
+        except BaseException as e:
+            self._abandon(owned, e)
+            raise
+
+        for (key, future), value in zip(owned.items(), values):
+            if isinstance(value, Exception):
+                future.set_exception(value)
+            else:
+                future.set_result(value)
+        try:
+            for (key, future), value in zip(owned.items(), values):
+                if not isinstance(value, Exception):
+                    await self.put(key, value)
+        finally:
+            for key in owned:
+                self._inflight.pop(key, None)
+
+    def _abandon(self, owned: Dict[str, asyncio.Future], error: BaseException = None):
+        for key, future in owned.items():
+            self._inflight.pop(key, None)
+            if future.done():
+                continue
+            if error is None or isinstance(error, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(error)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.shared_hits + self.inflight_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "inflight_hits": self.inflight_hits,
+            "misses": self.misses,
+            "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "shared": self.shared is not None,
+        }
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,45 @@
+"""
+Wire formats for embeddings, negotiated with the Accept header.
+
+application/json (default) keeps embeddings as JSON float lists. The compact
+media types keep the same JSON envelope but send each embedding as base64 of
+its little-endian float32 / float16 bytes: ~1.4 KB / 0.7 KB for 256 dims
+instead of ~5 KB of decimal text, and no per-float formatting or parsing.
+"""
+import base64
+from typing import Optional
+
+import numpy as np
+
+EMBEDDING_JSON = "application/json"
+EMBEDDING_F32 = "application/vnd.face-embedding.f32+json"
+EMBEDDING_F16 = "application/vnd.face-embedding.f16+json"
+
+COMPACT_DTYPES = {
+    EMBEDDING_F32: np.dtype("<f4"),
+    EMBEDDING_F16: np.dtype("<f2"),
+}
+
+# WebSocket clients pick the format with ?encoding= instead of Accept
+STREAM_ENCODINGS = {
+    "json": EMBEDDING_JSON,
+    "f32": EMBEDDING_F32,
+    "f16": EMBEDDING_F16,
+}
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    First compact media type listed in Accept, else plain JSON.
+    """
+    if accept:
+        for part in accept.split(","):
+            media_type = part.split(";")[0].strip().lower()
+            if media_type in COMPACT_DTYPES:
+                return media_type
+    return EMBEDDING_JSON
+
+def encode_embedding(embedding: np.ndarray, media_type: str):
+    dtype = COMPACT_DTYPES.get(media_type)
+    if dtype is None:
+        return embedding.tolist()
+    return base64.b64encode(np.asarray(embedding).astype(dtype, copy=False).tobytes()).decode("ascii")
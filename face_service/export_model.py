@@ -0,0 +1,98 @@
+"""
+Export EmbeddingNet to TorchScript / ONNX and check parity with eager PyTorch.
+
+Usage:
+    python export_model.py --format all
+    python export_model.py --format onnx --atol 1e-4
+"""
+import argparse
+import inspect
+import sys
+
+import numpy as np
+import torch
+
+from face_ulti import (
+    IMG_SIZE,
+    ONNX_MODEL_PATH,
+    TORCHSCRIPT_MODEL_PATH,
+    build_eager_model,
+    load_embedding_backend,
+)
+
+EXPORT_BACKENDS = {
+    "torchscript": "torchscript",
+    "onnx": "onnxruntime-cpu",
+}
+
+def export_torchscript(model: torch.nn.Module, example: torch.Tensor, path: str):
+    with torch.no_grad():
+        traced = torch.jit.trace(model.embedding, example)
+    traced.save(path)
+    print(f"TorchScript model saved to {path}")
+
+def export_onnx(model: torch.nn.Module, example: torch.Tensor, path: str):
+    export_kwargs = {}
+    # keep the TorchScript-based exporter on torch versions that default to dynamo
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs["dynamo"] = False
+
+    torch.onnx.export(
+        model.embedding,
+        example,
+        path,
+        input_names=["input"],
+        output_names=["embedding"],
+        dynamic_axes={"input": {0: "batch"}, "embedding": {0: "batch"}},
+        opset_version=17,
+        **export_kwargs,
+    )
+    print(f"ONNX model saved to {path}")
+
+def check_parity(reference: np.ndarray, candidate: np.ndarray, atol: float) -> bool:
+    max_abs_diff = float(np.abs(reference - candidate).max())
+    cosine = np.sum(reference * candidate, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    min_cosine = float(cosine.min())
+
+    print(f"  max |diff| = {max_abs_diff:.2e}, min cosine = {min_cosine:.6f}")
+    return max_abs_diff <= atol
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=["torchscript", "onnx", "all"], default="all")
+    parser.add_argument("--atol", type=float, default=1e-4, help="max absolute embedding difference vs eager")
+    parser.add_argument("--batch-size", type=int, default=8, help="batch size of the parity check input")
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    model = build_eager_model(device)
+
+    formats = ["torchscript", "onnx"] if args.format == "all" else [args.format]
+    example = torch.randn(1, 3, IMG_SIZE, IMG_SIZE)
+
+    for fmt in formats:
+        if fmt == "torchscript":
+            export_torchscript(model, example, TORCHSCRIPT_MODEL_PATH)
+        else:
+            export_onnx(model, example, ONNX_MODEL_PATH)
+
+    torch.manual_seed(0)
+    parity_input = torch.randn(args.batch_size, 3, IMG_SIZE, IMG_SIZE)
+    with torch.no_grad():
+        reference = model.embedding(parity_input).numpy()
+
+    ok = True
+    for fmt in formats:
+        backend = EXPORT_BACKENDS[fmt]
+        print(f"Parity check: {backend} vs torch-eager")
+        run = load_embedding_backend(backend, device)
+        if not check_parity(reference, run(parity_input), args.atol):
+            print(f"  FAILED: {backend} embeddings differ from eager by more than {args.atol}")
+            ok = False
+
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,36 +1,60 @@
 
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import io
 import os
-from typing import Optional, List
-from datetime import datetime
+import pickle
+import threading
+from typing import Any, Callable, Dict, Optional, List
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torchvision.models as models
-import torchvision.transforms as transforms
 from torchvision.models import MobileNet_V2_Weights
 
 import cv2
 import numpy as np
 from PIL import Image
-from facenet_pytorch import MTCNN
+from facenet_pytorch import MTCNN, extract_face
+
+from debug_capture import debug_capture
 
-_model = None
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
+_embed_fn = None
 _device = None
-_transform = None
 _mtcnn = None
+_ready = False
+_load_lock = threading.Lock()
+_startup_timings: Dict[str, float] = {"import": round(_IMPORT_SECONDS, 3)}
 
 IMG_SIZE = 160
 EMBEDDING_DIM = 256
-MODEL_PATH = "siamese_mobilenetv2_best.pth"
-
-TEMP_SAVE_DIR = "tmp_images"
-os.makedirs(TEMP_SAVE_DIR, exist_ok=True)
+MODEL_PATH = os.getenv("MODEL_PATH", "siamese_mobilenetv2_best.pth")
+TORCHSCRIPT_MODEL_PATH = os.getenv("TORCHSCRIPT_MODEL_PATH", "siamese_mobilenetv2_best.ts")
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", "siamese_mobilenetv2_best.onnx")
+QUANTIZED_MODEL_PATH = os.getenv("QUANTIZED_MODEL_PATH", "siamese_mobilenetv2_int8.ts")
+QUANTIZED_ENGINE = os.getenv("QUANTIZED_ENGINE", "")
+
+INFERENCE_BACKENDS = ("torch-eager", "torchscript", "onnxruntime-cpu", "torch-int8")
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch-eager")
+WARMUP_BATCH_SIZE = int(os.getenv("WARMUP_BATCH_SIZE", "4"))
+MIN_FACE_PROBABILITY = float(os.getenv("MIN_FACE_PROBABILITY", "0.9"))
+
+NORMALIZE_MEAN = [0.485, 0.456, 0.406]
+NORMALIZE_STD = [0.229, 0.224, 0.225]
+_NORMALIZE_MEAN_T = torch.tensor(NORMALIZE_MEAN).view(1, 3, 1, 1)
+_NORMALIZE_STD_T = torch.tensor(NORMALIZE_STD).view(1, 3, 1, 1)
 
 class EmbeddingNet(nn.Module):
-    def __init__(self, embedding_dim=EMBEDDING_DIM):
+    def __init__(self, embedding_dim=EMBEDDING_DIM, pretrained_backbone=False):
         super().__init__()
-        mobilenet = models.mobilenet_v2(weights=MobileNet_V2_Weights.DEFAULT)
+        # ImageNet weights are only useful as a training starting point; for
+        # serving they are overwritten by the fine-tuned checkpoint anyway.
+        weights = MobileNet_V2_Weights.DEFAULT if pretrained_backbone else None
+        mobilenet = models.mobilenet_v2(weights=weights)
         self.backbone = mobilenet.features
         self.pool = nn.AdaptiveAvgPool2d(1)
         self.fc = nn.Sequential(
@@ -50,89 +74,301 @@ class SiameseNet(nn.Module):
         super().__init__()
         self.embedding = EmbeddingNet(embedding_dim)
 
-def load_model_once():
+def select_quantized_engine() -> str:
+    supported = torch.backends.quantized.supported_engines
+    if QUANTIZED_ENGINE:
+        engine = QUANTIZED_ENGINE
+    elif "x86" in supported:
+        engine = "x86"
+    elif "fbgemm" in supported:
+        engine = "fbgemm"
+    else:
+        engine = "qnnpack"
 
-    global _model, _device, _transform, _mtcnn
-    if _model is not None:
-        return
+    torch.backends.quantized.engine = engine
+    return engine
 
-    print("Loading AI models...")
-    _device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+def load_state_dict_file(path: str, device: torch.device) -> dict:
+
+    if path.endswith(".safetensors"):
+        from safetensors.torch import load_file
+        return load_file(path, device=str(device))
+
+    try:
+        # memory-map the checkpoint so tensors are paged in instead of copied
+        return torch.load(path, map_location=device, mmap=True, weights_only=True)
+    except pickle.UnpicklingError as e:
+        # the checkpoint holds more than tensors; it ships with the service, so
+        # load it the way it was saved (newer torch defaults weights_only=True)
+        print(f"weights-only load rejected the checkpoint ({e}), falling back to a full torch.load")
+        return torch.load(path, map_location=device, weights_only=False)
+    except (TypeError, RuntimeError) as e:
+        # older torch, or a legacy (non-zip) checkpoint that cannot be mmapped
+        print(f"mmap load unavailable ({e}), falling back to a regular torch.load")
+        return torch.load(path, map_location=device)
+
+def build_eager_model(device: torch.device, timings: Optional[Dict[str, float]] = None) -> SiameseNet:
+
+    started = time.perf_counter()
+    try:
+        # build on the meta device: no random init, parameters come from the checkpoint
+        with torch.device("meta"):
+            model = SiameseNet(embedding_dim=EMBEDDING_DIM)
+        assign = True
+    except (AttributeError, TypeError):
+        model = SiameseNet(embedding_dim=EMBEDDING_DIM).to(device)
+        assign = False
+    built = time.perf_counter()
 
-    _model = SiameseNet(embedding_dim=EMBEDDING_DIM).to(_device)
     try:
-        _model.load_state_dict(torch.load(MODEL_PATH, map_location=_device))
+        state_dict = load_state_dict_file(MODEL_PATH, device)
     except FileNotFoundError:
         print(f"Error: Model file not found at {MODEL_PATH}")
         raise
 
-    _model.eval()
+    if assign:
+        model.load_state_dict(state_dict, assign=True)
+        model = model.to(device)
+    else:
+        model.load_state_dict(state_dict)
+    loaded = time.perf_counter()
 
-    _transform = transforms.Compose([
-        transforms.ToPILImage(),
-        transforms.Resize((IMG_SIZE, IMG_SIZE)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                             std=[0.229, 0.224, 0.225])
-    ])
+    if timings is not None:
+        timings["build"] = round(built - started, 3)
+        timings["load"] = round(loaded - built, 3)
 
-    print("Initializing MTCNN...")
-    _mtcnn = MTCNN(keep_all=False, post_process=False, device=_device)
+    model.eval()
+    return model
 
-    print("AI Models ready.")
+def load_embedding_backend(
+    backend: str,
+    device: torch.device,
+    timings: Optional[Dict[str, float]] = None,
+) -> Callable[[torch.Tensor], np.ndarray]:
 
-import tempfile
+    if backend == "torch-eager":
+        model = build_eager_model(device, timings)
 
-def save_image_temp(img: np.ndarray) -> str:
-    try:
-        fd, file_path = tempfile.mkstemp(suffix=".jpg")
-        os.close(fd)
-        
-        cv2.imwrite(file_path, img)
-        return file_path
-    except Exception as e:
-        print(f"Error saving temp image: {e}")
-        return ""
-
-def detect_face(image: np.ndarray) -> Optional[np.ndarray]:
-
-    if _mtcnn is None:
-        load_model_once()
+        def run(batch: torch.Tensor) -> np.ndarray:
+            with torch.no_grad():
+                return model.embedding(batch).cpu().numpy()
 
-    img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    img_pil = Image.fromarray(img_rgb)
+        return run
 
-    face_tensor = _mtcnn(img_pil)
+    if backend == "torchscript":
+        module = torch.jit.load(TORCHSCRIPT_MODEL_PATH, map_location=device)
+        module.eval()
 
-    if face_tensor is None:
-        return None
+        def run(batch: torch.Tensor) -> np.ndarray:
+            with torch.no_grad():
+                return module(batch).cpu().numpy()
 
-    face_np = face_tensor.permute(1, 2, 0).cpu().numpy()
+        return run
 
-    face_np = face_np.astype(np.uint8)
+    if backend == "torch-int8":
+        # quantized kernels are CPU only
+        select_quantized_engine()
+        module = torch.jit.load(QUANTIZED_MODEL_PATH, map_location="cpu")
+        module.eval()
 
-    face_bgr = cv2.cvtColor(face_np, cv2.COLOR_RGB2BGR)
+        def run(batch: torch.Tensor) -> np.ndarray:
+            with torch.no_grad():
+                return module(batch.cpu()).numpy()
 
-    save_image_temp(face_bgr)
+        return run
 
-    return face_bgr
+    if backend == "onnxruntime-cpu":
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("onnxruntime is not installed, cannot use the onnxruntime-cpu backend")
 
-def image_to_embedding(image: np.ndarray) -> Optional[List[float]]:
+        session = ort.InferenceSession(ONNX_MODEL_PATH, providers=["CPUExecutionProvider"])
+        input_name = session.get_inputs()[0].name
 
-    try:
-        face = detect_face(image)
-        if face is None:
-            return None
-        if face is None:
-            return None
-            
-        face_rgb = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
-        img_tensor = _transform(face_rgb).unsqueeze(0).to(_device)
-        
-        with torch.no_grad():
-            embedding = _model.embedding(img_tensor)
-
-        return embedding.cpu().numpy().flatten().tolist()
-    except Exception as e:
-        print(f"Error in image_to_embedding: {str(e)}")
-        return None
\ No newline at end of file
+        def run(batch: torch.Tensor) -> np.ndarray:
+            return session.run(None, {input_name: batch.cpu().numpy()})[0]
+
+        return run
+
+    raise ValueError(f"Unknown inference backend: {backend} (expected one of {', '.join(INFERENCE_BACKENDS)})")
+
+def model_info() -> dict:
+    info = {
+        "backend": INFERENCE_BACKEND,
+        "ready": _ready,
+        "startup_timings": dict(_startup_timings),
+    }
+    if INFERENCE_BACKEND == "torch-int8":
+        info["quantized_engine"] = torch.backends.quantized.engine
+    return info
+
+def _warm_up():
+    dummy = torch.zeros(WARMUP_BATCH_SIZE, 3, IMG_SIZE, IMG_SIZE, device=_device)
+    _embed_fn(dummy)
+    _mtcnn(np.zeros((IMG_SIZE * 2, IMG_SIZE * 2, 3), dtype=np.uint8))
+
+def load_model_once():
+
+    global _embed_fn, _device, _mtcnn, _ready
+    if _ready:
+        return
+
+    with _load_lock:
+        if _ready:
+            return
+
+        print(f"Loading AI models (backend: {INFERENCE_BACKEND})...")
+        _device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+        started = time.perf_counter()
+        _embed_fn = load_embedding_backend(INFERENCE_BACKEND, _device, _startup_timings)
+        _startup_timings.setdefault("load", round(time.perf_counter() - started, 3))
+
+        print("Initializing MTCNN...")
+        started = time.perf_counter()
+        _mtcnn = MTCNN(image_size=IMG_SIZE, keep_all=False, post_process=False, device=_device)
+        _startup_timings["mtcnn_init"] = round(time.perf_counter() - started, 3)
+
+        started = time.perf_counter()
+        _warm_up()
+        _startup_timings["warmup"] = round(time.perf_counter() - started, 3)
+
+        _ready = True
+        print(f"AI Models ready. Startup timings (s): {_startup_timings}")
+
+def decode_image(data: bytes) -> np.ndarray:
+    """
+    Decode encoded image bytes straight into the RGB uint8 array MTCNN consumes.
+    """
+    if not data:
+        raise ValueError("Empty image")
+
+    # EXIF orientation is ignored, as it was with the previous PIL decode
+    image = cv2.imdecode(
+        np.frombuffer(data, dtype=np.uint8),
+        cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION,
+    )
+    if image is None:
+        # formats OpenCV cannot read (e.g. GIF) still go through PIL
+        try:
+            return np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))
+        except Exception as e:
+            raise ValueError(f"Invalid image: {str(e)}")
+
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+
+def detect_faces(images: List[np.ndarray]) -> List[Optional[torch.Tensor]]:
+    """
+    images: RGB uint8 arrays. Returns one 3xIMG_SIZExIMG_SIZE crop (0-255) per
+    image, or None when no face was found.
+    """
+    if not _ready:
+        load_model_once()
+
+    faces: List[Optional[torch.Tensor]] = [None] * len(images)
+
+    # MTCNN only batches images of equal size, so group frames by shape
+    # and run one detection pass per group.
+    groups = {}
+    for idx, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(idx)
+
+    for indices in groups.values():
+        face_tensors = _mtcnn([images[i] for i in indices])
+        for i, face_tensor in zip(indices, face_tensors):
+            faces[i] = face_tensor
+            if face_tensor is not None:
+                debug_capture.maybe_capture(face_tensor)
+
+    return faces
+
+def preprocess_faces(faces: torch.Tensor) -> torch.Tensor:
+    """
+    faces: Nx3xHxW crops with values in 0-255. Returns the normalized model input.
+    """
+    faces = faces.float()
+    if faces.shape[-2:] != (IMG_SIZE, IMG_SIZE):
+        faces = F.interpolate(faces, size=(IMG_SIZE, IMG_SIZE), mode="bilinear", align_corners=False)
+
+    mean = _NORMALIZE_MEAN_T.to(faces.device)
+    std = _NORMALIZE_STD_T.to(faces.device)
+    return faces.div_(255.0).sub_(mean).div_(std)
+
+def embed_faces(faces: List[torch.Tensor]) -> np.ndarray:
+
+    batch = preprocess_faces(torch.stack(faces).to(_device))
+    return _embed_fn(batch)
+
+def images_to_embeddings(images: List[np.ndarray]) -> List[Optional[np.ndarray]]:
+    """
+    float32 embedding per image, or None when no face was found. Encoding for
+    the wire (JSON list or compact base64) is left to the caller.
+    """
+    results: List[Optional[np.ndarray]] = [None] * len(images)
+    if not images:
+        return results
+
+    faces = detect_faces(images)
+    found = [i for i, face in enumerate(faces) if face is not None]
+    if not found:
+        return results
+
+    embeddings = embed_faces([faces[i] for i in found]).astype(np.float32, copy=False)
+    for i, embedding in zip(found, embeddings):
+        results[i] = embedding
+
+    return results
+
+def detect_all_faces(images: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+    """
+    Multi-face detection. For each RGB image returns every face above
+    MIN_FACE_PROBABILITY as {"box", "probability", "face"}, largest first.
+    """
+    if not _ready:
+        load_model_once()
+
+    detections: List[List[Dict[str, Any]]] = [[] for _ in images]
+
+    groups = {}
+    for idx, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(idx)
+
+    for indices in groups.values():
+        batch_boxes, batch_probs = _mtcnn.detect([images[i] for i in indices])
+        for i, boxes, probs in zip(indices, batch_boxes, batch_probs):
+            if boxes is None:
+                continue
+            for box, prob in zip(boxes, probs):
+                if prob is None or prob < MIN_FACE_PROBABILITY:
+                    continue
+                face = extract_face(images[i], box, IMG_SIZE, _mtcnn.margin)
+                debug_capture.maybe_capture(face)
+                detections[i].append({
+                    "box": [float(v) for v in box],
+                    "probability": float(prob),
+                    "face": face,
+                })
+
+            detections[i].sort(
+                key=lambda d: (d["box"][2] - d["box"][0]) * (d["box"][3] - d["box"][1]),
+                reverse=True,
+            )
+
+    return detections
+
+def images_to_face_embeddings(images: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+    """
+    Every face of every image, with box, detection probability and embedding.
+    All crops go through the embedding model in one batched forward.
+    """
+    detections = detect_all_faces(images)
+    flat = [d for image_detections in detections for d in image_detections]
+    if not flat:
+        return [[] for _ in images]
+
+    embeddings = embed_faces([d.pop("face") for d in flat]).astype(np.float32, copy=False)
+    for detection, embedding in zip(flat, embeddings):
+        detection["embedding"] = embedding
+
+    return detections
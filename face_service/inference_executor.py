@@ -0,0 +1,131 @@
+"""
+Bounded worker pool for blocking decode / inference work.
+"""
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+import torch
+
+from face_ulti import load_model_once
+
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "64"))
+INFERENCE_RETRY_AFTER_SECONDS = int(os.getenv("INFERENCE_RETRY_AFTER_SECONDS", "1"))
+
+def _usable_cpus() -> int:
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+def physical_cores() -> int:
+    # capped by the CPUs this process may run on (taskset, container cpusets)
+    usable = _usable_cpus()
+    try:
+        cores = set()
+        physical_id = None
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("physical id"):
+                    physical_id = line.split(":")[1].strip()
+                elif line.startswith("core id"):
+                    cores.add((physical_id, line.split(":")[1].strip()))
+        if cores:
+            return min(len(cores), usable)
+    except OSError:
+        pass
+
+    return usable
+
+def _init_process_worker(num_threads: int):
+    torch.set_num_threads(num_threads)
+    load_model_once()
+
+class ExecutorSaturated(Exception):
+
+    def __init__(self, retry_after: int = INFERENCE_RETRY_AFTER_SECONDS):
+        super().__init__("Inference executor is saturated")
+        self.retry_after = retry_after
+
+class InferenceExecutor:
+
+    def __init__(
+        self,
+        kind: str = INFERENCE_EXECUTOR,
+        workers: int = INFERENCE_WORKERS,
+        max_pending: int = INFERENCE_MAX_PENDING,
+        retry_after: int = INFERENCE_RETRY_AFTER_SECONDS,
+    ):
+        cores = physical_cores()
+        self.kind = kind
+        self.workers = workers if workers > 0 else max(1, cores // 2)
+        self.threads_per_worker = max(1, cores // self.workers)
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+
+        self._pool: Optional[Executor] = None
+        self._pending = 0
+        self._rejected = 0
+
+    def start(self):
+        if self._pool is not None:
+            return
+
+        if self.kind == "process":
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_process_worker,
+                initargs=(self.threads_per_worker,),
+            )
+        else:
+            # intra-op threads are shared by all worker threads of this process
+            torch.set_num_threads(self.threads_per_worker)
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="inference",
+            )
+
+        print(
+            f"Inference executor: {self.kind} x{self.workers}, "
+            f"{self.threads_per_worker} torch threads per worker"
+        )
+
+    def shutdown(self):
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    @property
+    def saturated(self) -> bool:
+        return self._pending >= self.max_pending
+
+    def reject(self):
+        self._rejected += 1
+        raise ExecutorSaturated(self.retry_after)
+
+    async def run(self, fn: Callable, *args, bounded: bool = True):
+        if self._pool is None:
+            self.start()
+        if bounded and self.saturated:
+            self.reject()
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, fn, *args)
+        finally:
+            self._pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "rejected": self._rejected,
+        }
@@ -1,17 +1,30 @@
 """
 Face Recognition API
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import numpy as np
-import cv2
-from PIL import Image
-import io
 import base64
+import binascii
+import asyncio
 
-from face_ulti import load_model_once, image_to_embedding
+from face_ulti import (
+    INFERENCE_BACKEND,
+    load_model_once,
+    images_to_embeddings,
+    images_to_face_embeddings,
+    model_info,
+    decode_image,
+)
+from batcher import EmbeddingBatcher
+from inference_executor import InferenceExecutor, ExecutorSaturated
+from debug_capture import debug_capture
+from streaming import LatestFrameSlot
+from embedding_codec import EMBEDDING_JSON, STREAM_ENCODINGS, encode_embedding, negotiate
+from embedding_cache import embedding_cache
 
 app = FastAPI(title="Face Embedding Service", version="1.0.0")
 
@@ -30,43 +43,331 @@ class EmbeddingResponse(BaseModel):
     embedding: Optional[List[float]] = None
     message: Optional[str] = None
 
+class ImageBatchBase64Request(BaseModel):
+    images_base64: List[str]
+
+class BatchEmbeddingItem(BaseModel):
+    index: int
+    success: bool
+    embedding: Optional[List[float]] = None
+    message: Optional[str] = None
+
+class BatchEmbeddingResponse(BaseModel):
+    success: bool
+    results: List[BatchEmbeddingItem]
+
+class FaceItem(BaseModel):
+    box: List[float]
+    probability: float
+    embedding: List[float]
+
+class MultiFaceResponse(BaseModel):
+    success: bool
+    faces: List[FaceItem] = []
+    message: Optional[str] = None
+
+executor = InferenceExecutor()
+batcher = EmbeddingBatcher(executor)
+
+model_status: Optional[dict] = None
+model_error: Optional[str] = None
+
+def _load_model() -> dict:
+    load_model_once()
+    return model_info()
+
+async def _load_model_in_background():
+    global model_status, model_error
+    try:
+        model_status = await executor.run(_load_model, bounded=False)
+    except Exception as e:
+        model_error = str(e)
+        print(f"Error loading AI models: {model_error}")
+
 @app.on_event("startup")
 async def startup():
-    load_model_once()
+    executor.start()
+    batcher.start()
+    # serve /health while the model loads and warms up in the worker pool
+    asyncio.create_task(_load_model_in_background())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await batcher.stop()
+    executor.shutdown()
 
-def base64_to_image(base64_str: str) -> np.ndarray:
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Face service is overloaded, retry later"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+def base64_to_bytes(base64_str: str) -> bytes:
     try:
         if ',' in base64_str:
             base64_str = base64_str.split(',')[1]
 
-        img_bytes = base64.b64decode(base64_str)
-        image = Image.open(io.BytesIO(img_bytes)).convert('RGB')
+        return base64.b64decode(base64_str)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid base64 image: {str(e)}")
+
+def _decode_batch(datas: List[bytes]) -> List[Optional[np.ndarray]]:
+    images = []
+    for data in datas:
+        try:
+            images.append(decode_image(data))
+        except ValueError:
+            images.append(None)
+    return images
+
+@app.get("/health")
+async def health_check():
+    if model_error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": model_error})
+    if model_status is None:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "healthy", "model": model_status}
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "executor": executor.stats(),
+        "batcher": batcher.stats(),
+        "debug_capture": debug_capture.stats(),
+        "embedding_cache": embedding_cache.stats(),
+    }
+
+def _cache_key(kind: str, img_bytes: bytes) -> str:
+    # keyed on the decoded image bytes, so base64, upload and binary websocket
+    # requests for the same image share an entry
+    return embedding_cache.key(f"{INFERENCE_BACKEND}:{kind}", img_bytes)
+
+async def _compute_embedding(img_bytes: bytes) -> Optional[np.ndarray]:
+    img = await executor.run(decode_image, img_bytes)
+    return await batcher.embed(img)
+
+async def _compute_faces(img_bytes: bytes) -> List[dict]:
+    img = await executor.run(decode_image, img_bytes)
+    return (await executor.run(images_to_face_embeddings, [img], bounded=False))[0]
+
+async def _cached_embedding(img_bytes: bytes) -> Optional[np.ndarray]:
+    """
+    Embedding of the image (None: no face), reused for identical image bytes.
+    Raises ValueError for undecodable images, which are not cached.
+    """
+    return await embedding_cache.get_or_compute(
+        _cache_key("single", img_bytes), lambda: _compute_embedding(img_bytes)
+    )
+
+async def _cached_faces(img_bytes: bytes) -> List[dict]:
+    return await embedding_cache.get_or_compute(
+        _cache_key("faces", img_bytes), lambda: _compute_faces(img_bytes)
+    )
+
+def _encode_faces(detections: List[dict], media_type: str) -> List[dict]:
+    # new dicts: the detections may be shared with the cache
+    return [
+        {**detection, "embedding": encode_embedding(detection["embedding"], media_type)}
+        for detection in detections
+    ]
+
+def _embedding_response(model, content: dict, media_type: str):
+    # compact encodings skip the response model: embeddings are base64 strings
+    if media_type == EMBEDDING_JSON:
+        return model(**content)
+    return JSONResponse(content=content, media_type=media_type)
 
-        img_array = np.array(image).astype(np.uint8)
+async def _extract_embedding(img_bytes: bytes, invalid_message: str, media_type: str = EMBEDDING_JSON):
+    try:
+        try:
+            embedding = await _cached_embedding(img_bytes)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=invalid_message)
 
-        img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+        if embedding is None:
+            return EmbeddingResponse(success=False, message="No face detected")
 
-        return img_bgr
+        return _embedding_response(
+            EmbeddingResponse,
+            {"success": True, "embedding": encode_embedding(embedding, media_type)},
+            media_type,
+        )
 
+    except (HTTPException, ExecutorSaturated):
+        raise
     except Exception as e:
-        raise ValueError(f"Invalid base64 image: {str(e)}")
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _read_upload(request: Request) -> bytes:
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Missing 'file' field in multipart upload")
+        return await upload.read()
+
+    return await request.body()
 
 @app.post("/api/embedding", response_model=EmbeddingResponse)
-async def extract_embedding_api(request: ImageBase64Request):
+async def extract_embedding_api(request: ImageBase64Request, accept: Optional[str] = Header(None)):
+    try:
+        img_bytes = base64_to_bytes(request.image_base64)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid base64 image")
+    return await _extract_embedding(img_bytes, "Invalid base64 image", negotiate(accept))
+
+@app.post("/api/embedding/upload", response_model=EmbeddingResponse)
+async def extract_embedding_upload_api(request: Request, accept: Optional[str] = Header(None)):
+    """
+    Raw image upload, either as an application/octet-stream body or as the
+    'file' field of a multipart form. Skips the base64 inflation and decode.
+    """
+    img_bytes = await _read_upload(request)
+    return await _extract_embedding(img_bytes, "Invalid image", negotiate(accept))
+
+@app.post("/api/embedding/batch", response_model=BatchEmbeddingResponse)
+async def extract_embedding_batch_api(request: ImageBatchBase64Request, accept: Optional[str] = Header(None)):
+    try:
+        media_type = negotiate(accept)
+
+        embeddings: list = [ValueError("Invalid base64 image")] * len(request.images_base64)
+        datas = {}
+        for idx, image_base64 in enumerate(request.images_base64):
+            try:
+                datas[idx] = base64_to_bytes(image_base64)
+            except ValueError:
+                pass
+        valid = list(datas)
+
+        async def compute(indices: List[int]) -> list:
+            decoded = await executor.run(_decode_batch, [datas[valid[i]] for i in indices])
+            images = [img for img in decoded if img is not None]
+            found = iter(await executor.run(images_to_embeddings, images, bounded=False) if images else [])
+            return [next(found) if img is not None else ValueError("Invalid base64 image") for img in decoded]
+
+        keys = [_cache_key("single", datas[idx]) for idx in valid]
+        for idx, embedding in zip(valid, await embedding_cache.get_or_compute_many(keys, compute)):
+            embeddings[idx] = embedding
+
+        results = []
+        for idx, embedding in enumerate(embeddings):
+            if isinstance(embedding, ValueError):
+                results.append({"index": idx, "success": False, "message": "Invalid base64 image"})
+            elif isinstance(embedding, Exception):
+                raise embedding
+            elif embedding is None:
+                results.append({"index": idx, "success": False, "message": "No face detected"})
+            else:
+                results.append({
+                    "index": idx,
+                    "success": True,
+                    "embedding": encode_embedding(embedding, media_type),
+                })
+
+        return _embedding_response(BatchEmbeddingResponse, {"success": True, "results": results}, media_type)
+
+    except (HTTPException, ExecutorSaturated):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/embedding/faces", response_model=MultiFaceResponse)
+async def extract_face_embeddings_api(request: ImageBase64Request, accept: Optional[str] = Header(None)):
+    """
+    Every face in the frame (e.g. a classroom camera), each with its bounding
+    box, detection probability and embedding.
+    """
     try:
+        media_type = negotiate(accept)
         try:
-            img = base64_to_image(request.image_base64)
-        except Exception:
+            detections = await _cached_faces(base64_to_bytes(request.image_base64))
+        except ValueError:
             raise HTTPException(status_code=400, detail="Invalid base64 image")
 
-        embedding = image_to_embedding(img)
-        if embedding is None:
-            return EmbeddingResponse(success=False, message="No face detected")
+        if not detections:
+            return MultiFaceResponse(success=False, message="No face detected")
 
-        return EmbeddingResponse(success=True, embedding=embedding)
+        return _embedding_response(
+            MultiFaceResponse, {"success": True, "faces": _encode_faces(detections, media_type)}, media_type
+        )
 
+    except (HTTPException, ExecutorSaturated):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+async def _receive_frames(websocket: WebSocket, slot: LatestFrameSlot):
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            seq = slot.received + 1
+            if message.get("bytes") is not None:
+                slot.put((seq, message["bytes"]))
+            elif message.get("text") is not None:
+                slot.put((seq, message["text"]))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        slot.close()
+
+async def _process_frame(payload, multi_face: bool, media_type: str) -> dict:
+    try:
+        # binary frames are image bytes, text frames base64
+        img_bytes = base64_to_bytes(payload) if isinstance(payload, str) else payload
+        if multi_face:
+            detections = await _cached_faces(img_bytes)
+        else:
+            embedding = await _cached_embedding(img_bytes)
+    except ValueError:
+        return {"success": False, "message": "Invalid image"}
+
+    if multi_face:
+        if not detections:
+            return {"success": False, "message": "No face detected"}
+        return {"success": True, "faces": _encode_faces(detections, media_type)}
+
+    if embedding is None:
+        return {"success": False, "message": "No face detected"}
+    return {"success": True, "embedding": encode_embedding(embedding, media_type)}
+
+@app.websocket("/ws/embedding")
+async def embedding_stream(websocket: WebSocket, mode: str = "single", encoding: str = "json"):
+    """
+    Streaming recognition. Clients send frames as binary (encoded image bytes)
+    or text (base64) messages; each reply is the JSON result for the newest
+    frame. Frames that arrive while one is being processed replace each other,
+    so only the latest one is processed and the rest are dropped.
+    encoding=f32|f16 sends embeddings as base64 like the compact media types.
+    """
+    await websocket.accept()
+    media_type = STREAM_ENCODINGS.get(encoding, EMBEDDING_JSON)
+    slot = LatestFrameSlot()
+    receiver = asyncio.create_task(_receive_frames(websocket, slot))
+    multi_face = mode == "faces"
+
+    try:
+        while True:
+            frame = await slot.get()
+            if frame is None:
+                break
+
+            seq, payload = frame
+            try:
+                result = await _process_frame(payload, multi_face, media_type)
+            except ExecutorSaturated:
+                result = {"success": False, "message": "Face service is overloaded"}
+            except Exception as e:
+                result = {"success": False, "message": str(e)}
+
+            result["frame"] = seq
+            result["dropped"] = slot.dropped
+            await websocket.send_json(result)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
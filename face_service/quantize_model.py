@@ -0,0 +1,205 @@
+"""
+INT8 static quantization of EmbeddingNet and accuracy check against fp32.
+
+Usage:
+    python quantize_model.py quantize --calibration-dir data/aligned_faces
+    python quantize_model.py evaluate --dataset data/labeled_faces
+
+The calibration directory is any folder of aligned face crops. The evaluation
+dataset is laid out as <dataset>/<person>/<image>, one folder per identity.
+"""
+import argparse
+import copy
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao.quantization import DeQuantStub, QuantStub, convert, fuse_modules, get_default_qconfig, prepare
+from torchvision.models.quantization import mobilenet_v2 as quantizable_mobilenet_v2
+from torchvision.models.quantization.mobilenetv2 import QuantizableInvertedResidual
+from torchvision.ops.misc import Conv2dNormActivation
+
+from face_ulti import (
+    IMG_SIZE,
+    QUANTIZED_MODEL_PATH,
+    EmbeddingNet,
+    build_eager_model,
+    load_embedding_backend,
+    preprocess_faces,
+    select_quantized_engine,
+)
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp"}
+MATCH_THRESHOLD = 1.0
+
+class QuantizableEmbeddingNet(nn.Module):
+
+    def __init__(self, float_net: EmbeddingNet):
+        super().__init__()
+        mobilenet = quantizable_mobilenet_v2(weights=None, quantize=False)
+        backbone = mobilenet.features
+        backbone.load_state_dict(float_net.backbone.state_dict())
+        backbone.eval()
+
+        for module in backbone.modules():
+            if type(module) is Conv2dNormActivation:
+                # torchvision swaps ReLU6 for ReLU to fuse conv-bn-relu; keep
+                # ReLU6 so activations match the float model we trained
+                if len(module) == 3:
+                    module[2] = nn.ReLU6()
+                fuse_modules(module, ["0", "1"], inplace=True)
+            elif type(module) is QuantizableInvertedResidual:
+                module.fuse_model()
+
+        self.quant = QuantStub()
+        self.backbone = backbone
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.fc = copy.deepcopy(float_net.fc)
+        self.dequant = DeQuantStub()
+
+    def forward(self, x):
+        x = self.quant(x)
+        x = self.backbone(x)
+        x = torch.flatten(self.pool(x), 1)
+        x = self.fc(x)
+        x = self.dequant(x)
+        return F.normalize(x, p=2, dim=1)
+
+def list_images(root: Path) -> List[Path]:
+    return sorted(p for p in root.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+
+def load_batch(paths: List[Path]) -> torch.Tensor:
+    """
+    Model input for face crops on disk, through the same preprocess_faces the
+    service applies to MTCNN crops, so calibration and evaluation see the
+    activations served in production.
+    """
+    tensors = []
+    for path in paths:
+        img = cv2.imread(str(path))
+        if img is None:
+            raise ValueError(f"Unreadable image: {path}")
+        face = torch.from_numpy(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)).permute(2, 0, 1)
+        # crops on disk come in any size; preprocess_faces resizes each one
+        tensors.append(preprocess_faces(face.unsqueeze(0)))
+    return torch.cat(tensors)
+
+def quantize(calibration_dir: Path, max_images: int, batch_size: int) -> int:
+    engine = select_quantized_engine()
+    paths = list_images(calibration_dir)[:max_images]
+    if not paths:
+        print(f"No calibration images found in {calibration_dir}")
+        return 1
+
+    float_model = build_eager_model(torch.device("cpu"))
+    model = QuantizableEmbeddingNet(float_model.embedding).eval()
+    model.qconfig = get_default_qconfig(engine)
+    prepare(model, inplace=True)
+
+    print(f"Calibrating on {len(paths)} images (engine: {engine})...")
+    with torch.no_grad():
+        for start in range(0, len(paths), batch_size):
+            model(load_batch(paths[start:start + batch_size]))
+
+    convert(model, inplace=True)
+
+    example = torch.randn(1, 3, IMG_SIZE, IMG_SIZE)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    traced.save(QUANTIZED_MODEL_PATH)
+    print(f"Quantized model saved to {QUANTIZED_MODEL_PATH}")
+    return 0
+
+def load_labeled_dataset(root: Path) -> Tuple[List[Path], np.ndarray]:
+    paths, labels = [], []
+    for person_dir in sorted(p for p in root.iterdir() if p.is_dir()):
+        for path in list_images(person_dir):
+            paths.append(path)
+            labels.append(person_dir.name)
+    return paths, np.array(labels)
+
+def embed_all(run, paths: List[Path], batch_size: int) -> Tuple[np.ndarray, float]:
+    chunks = []
+    elapsed = 0.0
+    for start in range(0, len(paths), batch_size):
+        batch = load_batch(paths[start:start + batch_size])
+        started = time.perf_counter()
+        chunks.append(run(batch))
+        elapsed += time.perf_counter() - started
+    return np.concatenate(chunks), elapsed
+
+def nearest_neighbours(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # embeddings are L2-normalised, so squared distance is 2 - 2 * cosine
+    sims = embeddings @ embeddings.T
+    np.fill_diagonal(sims, -np.inf)
+    nearest = sims.argmax(axis=1)
+    dist = np.sqrt(np.maximum(2.0 - 2.0 * sims[np.arange(len(sims)), nearest], 0.0))
+    return nearest, dist
+
+def match_accuracy(embeddings: np.ndarray, labels: np.ndarray) -> Tuple[float, float]:
+    nearest, dist = nearest_neighbours(embeddings)
+    rank1 = float(np.mean(labels[nearest] == labels))
+    accepted = float(np.mean((labels[nearest] == labels) & (dist < MATCH_THRESHOLD)))
+    return rank1, accepted
+
+def evaluate(dataset_dir: Path, batch_size: int, max_accuracy_drop: float) -> int:
+    paths, labels = load_labeled_dataset(dataset_dir)
+    if len(paths) < 2:
+        print(f"Need at least two labeled images in {dataset_dir}")
+        return 1
+
+    device = torch.device("cpu")
+    fp32, fp32_time = embed_all(load_embedding_backend("torch-eager", device), paths, batch_size)
+    int8, int8_time = embed_all(load_embedding_backend("torch-int8", device), paths, batch_size)
+
+    cosine = np.sum(fp32 * int8, axis=1)
+    l2 = np.linalg.norm(fp32 - int8, axis=1)
+    fp32_rank1, fp32_accepted = match_accuracy(fp32, labels)
+    int8_rank1, int8_accepted = match_accuracy(int8, labels)
+    same_neighbour = float(np.mean(nearest_neighbours(fp32)[0] == nearest_neighbours(int8)[0]))
+
+    print(f"Images: {len(paths)}, identities: {len(set(labels))}")
+    print("Embedding drift (int8 vs fp32):")
+    print(f"  cosine   mean={cosine.mean():.5f} min={cosine.min():.5f}")
+    print(f"  L2 dist  mean={l2.mean():.5f} max={l2.max():.5f}")
+    print("Match accuracy (leave-one-out nearest neighbour):")
+    print(f"  fp32 rank-1={fp32_rank1:.4f} accepted@{MATCH_THRESHOLD}={fp32_accepted:.4f}")
+    print(f"  int8 rank-1={int8_rank1:.4f} accepted@{MATCH_THRESHOLD}={int8_accepted:.4f}")
+    print(f"  same nearest neighbour: {same_neighbour:.4f}")
+    print("CPU time per face:")
+    print(f"  fp32 {fp32_time / len(paths) * 1000:.2f} ms, int8 {int8_time / len(paths) * 1000:.2f} ms "
+          f"({fp32_time / max(int8_time, 1e-9):.2f}x)")
+
+    if fp32_rank1 - int8_rank1 > max_accuracy_drop:
+        print(f"FAILED: rank-1 accuracy dropped by more than {max_accuracy_drop}")
+        return 1
+    return 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    quantize_parser = subparsers.add_parser("quantize", help="calibrate and save the int8 model")
+    quantize_parser.add_argument("--calibration-dir", type=Path, required=True)
+    quantize_parser.add_argument("--max-images", type=int, default=500)
+    quantize_parser.add_argument("--batch-size", type=int, default=32)
+
+    evaluate_parser = subparsers.add_parser("evaluate", help="compare int8 against fp32 on a labeled set")
+    evaluate_parser.add_argument("--dataset", type=Path, required=True)
+    evaluate_parser.add_argument("--batch-size", type=int, default=32)
+    evaluate_parser.add_argument("--max-accuracy-drop", type=float, default=0.01)
+
+    args = parser.parse_args()
+
+    if args.command == "quantize":
+        return quantize(args.calibration_dir, args.max_images, args.batch_size)
+    return evaluate(args.dataset, args.batch_size, args.max_accuracy_drop)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+Latest-frame-wins buffer for streaming recognition.
+"""
+import asyncio
+from typing import Any, Optional
+
+class LatestFrameSlot:
+    """
+    Holds at most one pending frame. A new frame replaces the one that has not
+    been picked up yet, so a slow consumer always works on the newest frame
+    instead of falling behind a queue of stale ones.
+    """
+
+    def __init__(self):
+        self._frame: Optional[Any] = None
+        self._event = asyncio.Event()
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame: Any):
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self.received += 1
+        self._event.set()
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+
+    async def get(self) -> Optional[Any]:
+        """
+        Newest pending frame, or None once the slot is closed and drained.
+        """
+        while self._frame is None:
+            if self._closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+
+        frame, self._frame = self._frame, None
+        return frame
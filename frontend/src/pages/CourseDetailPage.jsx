@@ -1,15 +1,48 @@
 // src/pages/CourseDetailPage.jsx
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useParams, Link, useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import './CourseDetailPage.css';
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://127.0.0.1:8000';
+const JOB_POLL_MS = 2000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+function describeJob(job) {
+  if (job.status === 'done') {
+    return `Hoàn tất: ghi danh ${job.enrolled} sinh viên (${job.profiles_created} hồ sơ mới).`;
+  }
+  if (job.status === 'failed') {
+    return `Lỗi: ${job.error || 'Không thể xử lý file.'}`;
+  }
+  if (job.status === 'queued') {
+    return 'Đang chờ xử lý...';
+  }
+  return `Đang xử lý: đã đọc ${job.rows_read} dòng, tìm thấy ${job.students_found} sinh viên...`;
+}
 
 function EnrollmentUploader({ courseId, courseName, onSuccess }) {
   const [file, setFile] = useState(null);
   const [isUploading, setIsUploading] = useState(false);
   const [message, setMessage] = useState('');
+  const mounted = useRef(true);
+
+  useEffect(() => {
+    mounted.current = true;
+    return () => { mounted.current = false; };
+  }, []);
+
+  // upload trả về job chạy nền; hỏi tiến độ đến khi job xong hoặc lỗi
+  const waitForJob = async (job) => {
+    while (mounted.current && job.status !== 'done' && job.status !== 'failed') {
+      setMessage(describeJob(job));
+      await sleep(JOB_POLL_MS);
+      const response = await axios.get(`${API_URL}/enrollments/jobs/${job.job_id}`);
+      job = response.data;
+    }
+    return job;
+  };
 
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -29,10 +62,13 @@ function EnrollmentUploader({ courseId, courseName, onSuccess }) {
       const response = await axios.post(`${API_URL}/enrollments/upload`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' },
       });
-      setMessage(response.data.message);
       setFile(null);
-      if (onSuccess) onSuccess();
+      const job = await waitForJob(response.data);
+      if (!mounted.current) return;
+      setMessage(describeJob(job));
+      if (job.status === 'done' && onSuccess) onSuccess();
     } catch (err) {
+      if (!mounted.current) return;
       setMessage(err.response?.data?.detail || 'Lỗi: Không thể xử lý file.');
     }
 
@@ -166,7 +202,7 @@ function StudentList({ courseId, refreshTrigger }) {
                 <div className="progress-info">
                   <span className="progress-label">Tiến độ:</span>
                   <span className="progress-fraction">
-                    {student.attended_count}/{student.total_sessions} buổi
+                    {student.attended_count}/{student.held_sessions} buổi
                   </span>
                   <span className="progress-percent" style={{color: getProgressColor(student.attendance_rate)}}>
                     {student.attendance_rate}%